@@ -3,6 +3,12 @@ import plotly.express as px
 import pandas as pd
 import os
 import warnings
+from ingest import cached_dataset, ingest
+from filters import DateIndex, HierarchyIndex
+from aggregates import Rollup, grouped_sums, treemap_nodes
+from charts import SCATTER_MAX_POINTS, payload_size, scatter_figure
+from export import lazy_download, state_key
+from tables import paged_table
 warnings.filterwarnings('ignore')
 
 st.set_page_config(page_title="Superstore!!!", page_icon=":bar_chart:",layout="wide")
@@ -14,17 +20,40 @@ fl = st.file_uploader(":file_folder: Upload a file",type=(["csv","txt","xlsx","x
 if fl is not None:
     filename = fl.name
     st.write(filename)
-    df = pd.read_csv(filename, encoding = "ISO-8859-1")
+    data_id = fl.file_id
 else:
     os.chdir(r"C:\Users\AEPAC\Desktop\Streamlit")
-    df = pd.read_csv("Superstore.csv", encoding = "ISO-8859-1")
+    filename = "Superstore.csv"
+    # A new version of the file on disk is a new dataset
+    data_id = f"{filename}:{os.stat(filename).st_mtime_ns}"
+
+# Parse each dataset once per process, streaming it in chunks into a compact columnar
+# frame sorted by Order Date, and index it alongside; every session reuses the result
+progress_bar = st.empty()
+
+def load_dataset():
+    data = ingest(fl if fl is not None else filename, filename, date_columns = ["Order Date"],
+                  progress = lambda done: progress_bar.progress(done, text = "Reading " + filename))
+    date_index = DateIndex(data, "Order Date")
+    hierarchy = HierarchyIndex(date_index.frame, ["Region", "State", "City"])
+    # Sales per order date and dimension combination, behind the time series and the month table
+    rollup = Rollup(date_index.frame, "Order Date",
+                    ["Region", "State", "City", "Category", "Sub-Category", "Segment"], "Sales")
+    return date_index, hierarchy, rollup
+
+try:
+    date_index, hierarchy, rollup = cached_dataset(data_id, load_dataset)
+except MemoryError as error:
+    st.error(str(error))
+    st.stop()
+progress_bar.empty()
+df = date_index.frame.copy(deep = False)
 
 col1, col2 = st.columns((2))
-df["Order Date"] = pd.to_datetime(df["Order Date"])
 
 # Getting the min and max date 
-startDate = pd.to_datetime(df["Order Date"]).min()
-endDate = pd.to_datetime(df["Order Date"]).max()
+startDate = date_index.first
+endDate = date_index.last
 
 with col1:
     date1 = pd.to_datetime(st.date_input("Start Date", startDate))
@@ -32,58 +61,48 @@ with col1:
 with col2:
     date2 = pd.to_datetime(st.date_input("End Date", endDate))
 
-df = df[(df["Order Date"] >= date1) & (df["Order Date"] <= date2)].copy()
+# Rows inside the date range: one contiguous run of positions into the date-sorted df
+date_positions = date_index.positions(date1, date2)
 
 st.sidebar.header("Choose your filter: ")
+# Each option list comes from the hierarchy index, restricted to the date range and the levels above it
 # Create for Region
-region = st.sidebar.multiselect("Pick your Region", df["Region"].unique())
-if not region:
-    df2 = df.copy()
-else:
-    df2 = df[df["Region"].isin(region)]
+region = st.sidebar.multiselect("Pick your Region", hierarchy.options("Region", positions = date_positions))
 
 # Create for State
-state = st.sidebar.multiselect("Pick the State", df2["State"].unique())
-if not state:
-    df3 = df2.copy()
-else:
-    df3 = df2[df2["State"].isin(state)]
+state = st.sidebar.multiselect("Pick the State", hierarchy.options("State", {"Region": region or None}, date_positions))
 
 # Create for City
-city = st.sidebar.multiselect("Pick the City",df3["City"].unique())
+city = st.sidebar.multiselect("Pick the City", hierarchy.options("City", {"Region": region or None, "State": state or None}, date_positions))
 
 # Filter the data based on Region, State and City
-
-if not region and not state and not city:
-    filtered_df = df
-elif not state and not city:
-    filtered_df = df[df["Region"].isin(region)]
-elif not region and not city:
-    filtered_df = df[df["State"].isin(state)]
-elif state and city:
-    filtered_df = df3[df["State"].isin(state) & df3["City"].isin(city)]
-elif region and city:
-    filtered_df = df3[df["Region"].isin(region) & df3["City"].isin(city)]
-elif region and state:
-    filtered_df = df3[df["Region"].isin(region) & df3["State"].isin(state)]
-elif city:
-    filtered_df = df3[df3["City"].isin(city)]
-else:
-    filtered_df = df3[df3["Region"].isin(region) & df3["State"].isin(state) & df3["City"].isin(city)]
-
-category_df = filtered_df.groupby(by = ["Category"], as_index = False)["Sales"].sum()
+selection = {"Region": region or None, "State": state or None, "City": city or None}
+filtered_df = hierarchy.select(df, selection, date_positions)
+# Identifies the filtered rows, for caching the table sort orders
+view_key = state_key(data_id, selection, date1, date2)
+
+# Each chart gets its input reduced to grouped sums first, so the figure JSON sent
+# to the browser depends on the number of groups, not on the number of orders
+category_df = grouped_sums(filtered_df, "Category", "Sales", sort = True)
+region_sales = grouped_sums(filtered_df, "Region", "Sales")
+segment_sales = grouped_sums(filtered_df, "Segment", "Sales")
+treemap_sales = treemap_nodes(filtered_df, ["Region","Category","Sub-Category"], "Sales")
+# Charts by name with the number of rows they were built from, for the payload report
+chart_payloads = {}
 
 with col1:
     st.subheader("Category wise Sales")
     fig = px.bar(category_df, x = "Category", y = "Sales", text = ['${:,.2f}'.format(x) for x in category_df["Sales"]],
                  template = "seaborn")
     st.plotly_chart(fig,use_container_width=True, height = 200)
+    chart_payloads["Category wise Sales (bar)"] = (fig, len(category_df))
 
 with col2:
     st.subheader("Region wise Sales")
-    fig = px.pie(filtered_df, values = "Sales", names = "Region", hole = 0.5)
-    fig.update_traces(text = filtered_df["Region"], textposition = "outside")
+    fig = px.pie(region_sales, values = "Sales", names = "Region", hole = 0.5)
+    fig.update_traces(text = region_sales["Region"], textposition = "outside")
     st.plotly_chart(fig,use_container_width=True)
+    chart_payloads["Region wise Sales"] = (fig, len(region_sales))
 
 cl1, cl2 = st.columns((2))
 with cl1:
@@ -95,18 +114,25 @@ with cl1:
 
 with cl2:
     with st.expander("Region_ViewData"):
-        region = filtered_df.groupby(by = "Region", as_index = False)["Sales"].sum()
+        region = region_sales
         st.write(region.style.background_gradient(cmap="Oranges"))
         csv = region.to_csv(index = False).encode('utf-8')
         st.download_button("Download Data", data = csv, file_name = "Region.csv", mime = "text/csv",
                         help = 'Click here to download the data as a CSV file')
         
-filtered_df["month_year"] = filtered_df["Order Date"].dt.to_period("M")
 st.subheader('Time Series Analysis')
 
-linechart = pd.DataFrame(filtered_df.groupby(filtered_df["month_year"].dt.strftime("%Y : %b"))["Sales"].sum()).reset_index()
-fig2 = px.line(linechart, x = "month_year", y="Sales", labels = {"Sales": "Amount"},height=500, width = 1000,template="gridon")
+# Answered from the roll-up: one pass over the date-range cells, not over the orders
+granularity = st.radio("Granularity", ["Day", "Week", "Month", "Quarter"], index = 2, horizontal = True)
+freq, period_name, label = {"Day": ("D", "day", "%Y-%m-%d"), "Week": ("W", "week", "%Y-%m-%d"),
+                            "Month": ("M", "month_year", "%Y : %b"), "Quarter": ("Q", "quarter", "%Y Q%q")}[granularity]
+timeline = rollup.timeline(selection, date1, date2, freq)
+# Weeks are labelled by the day they start on
+periods = timeline.index.start_time if freq == "W" else timeline.index
+linechart = pd.DataFrame({period_name: periods.strftime(label), "Sales": timeline.to_numpy()})
+fig2 = px.line(linechart, x = period_name, y="Sales", labels = {"Sales": "Amount"},height=500, width = 1000,template="gridon")
 st.plotly_chart(fig2,use_container_width=True)
+chart_payloads["Time Series"] = (fig2, len(linechart))
 
 with st.expander("View Data of TimeSeries:"):
     st.write(linechart.T.style.background_gradient(cmap="Blues"))
@@ -115,46 +141,62 @@ with st.expander("View Data of TimeSeries:"):
 
 # Create a treem based on Region, category, sub-Category
 st.subheader("Hierarchical view of Sales using TreeMap")
-fig3 = px.treemap(filtered_df, path = ["Region","Category","Sub-Category"], values = "Sales",hover_data = ["Sales"],
-                  color = "Sub-Category")
+# Built from the precomputed totals of every Region / Category / Sub-Category node
+fig3 = px.treemap(treemap_sales, ids = "ids", names = "labels", parents = "parents", values = "Sales",
+                  branchvalues = "total", hover_data = ["Sales"], color = "Sub-Category")
 fig3.update_layout(width = 800, height = 650)
 st.plotly_chart(fig3, use_container_width=True)
+chart_payloads["TreeMap"] = (fig3, len(treemap_sales))
 
 chart1, chart2 = st.columns((2))
 with chart1:
     st.subheader('Segment wise Sales')
-    fig = px.pie(filtered_df, values = "Sales", names = "Segment", template = "plotly_dark")
-    fig.update_traces(text = filtered_df["Segment"], textposition = "inside")
+    fig = px.pie(segment_sales, values = "Sales", names = "Segment", template = "plotly_dark")
+    fig.update_traces(text = segment_sales["Segment"], textposition = "inside")
     st.plotly_chart(fig,use_container_width=True)
+    chart_payloads["Segment wise Sales"] = (fig, len(segment_sales))
 
 with chart2:
     st.subheader('Category wise Sales')
-    fig = px.pie(filtered_df, values = "Sales", names = "Category", template = "gridon")
-    fig.update_traces(text = filtered_df["Category"], textposition = "inside")
+    fig = px.pie(category_df, values = "Sales", names = "Category", template = "gridon")
+    fig.update_traces(text = category_df["Category"], textposition = "inside")
     st.plotly_chart(fig,use_container_width=True)
+    chart_payloads["Category wise Sales (pie)"] = (fig, len(category_df))
 
 import plotly.figure_factory as ff
 st.subheader(":point_right: Month wise Sub-Category Sales Summary")
 with st.expander("Summary_Table"):
-    df_sample = df[0:5][["Region","State","City","Category","Sales","Profit","Quantity"]]
+    df_sample = df.take(date_positions[:5])[["Region","State","City","Category","Sales","Profit","Quantity"]]
     fig = ff.create_table(df_sample, colorscale = "Cividis")
     st.plotly_chart(fig, use_container_width=True)
 
     st.markdown("Month wise sub-Category Table")
-    filtered_df["month"] = filtered_df["Order Date"].dt.month_name()
-    sub_category_Year = pd.pivot_table(data = filtered_df, values = "Sales", index = ["Sub-Category"],columns = "month")
-    st.write(sub_category_Year.style.background_gradient(cmap="Blues"))
-
-# Create a scatter plot
-data1 = px.scatter(filtered_df, x = "Sales", y = "Profit", size = "Quantity")
+    sub_category_Year = rollup.mean_table(selection, date1, date2, index = "Sub-Category",
+                                          columns = lambda dates: dates.dt.month_name().rename("month"), monthly = True)
+    paged_table(sub_category_Year, "month_table", data_key = view_key, gradient = "Blues", page_size = 25)
+
+# Create a scatter plot; large selections switch to WebGL and then get reduced
+reduction = "sample"
+if len(filtered_df) > SCATTER_MAX_POINTS:
+    reduction = st.radio("Too many orders to plot individually, show", ["sample", "density"], horizontal = True,
+                         format_func = {"sample": "Stratified sample (keeps outliers)", "density": "Density grid"}.get)
+data1 = scatter_figure(filtered_df, "Sales", "Profit", "Quantity", reduction)
 data1['layout'].update(title="Relationship between Sales and Profits using Scatter Plot.",
                        titlefont = dict(size=20),xaxis = dict(title="Sales",titlefont=dict(size=19)),
                        yaxis = dict(title = "Profit", titlefont = dict(size=19)))
 st.plotly_chart(data1,use_container_width=True)
+chart_payloads["Sales vs Profit scatter"] = (data1, len(filtered_df))
+
+# Per-chart size of the JSON sent to the browser, to check it stays flat as the data grows
+with st.expander("Chart payload sizes"):
+    if st.checkbox("Measure chart payloads"):
+        st.dataframe(pd.DataFrame([(name, rows, payload_size(fig)) for name, (fig, rows) in chart_payloads.items()],
+                                  columns = ["chart", "input rows", "payload bytes"]))
 
 with st.expander("View Data"):
-    st.write(filtered_df.iloc[:500,1:20:2].style.background_gradient(cmap="Oranges"))
+    # Every filtered row, paged; only the page on screen is styled and sent
+    paged_table(filtered_df.iloc[:,1:20:2], "view_data", data_key = view_key, gradient = "Oranges")
 
-# Download orginal DataSet
-csv = df.to_csv(index = False).encode('utf-8')
-st.download_button('Download Data', data = csv, file_name = "Data.csv",mime = "text/csv")
+# Download orginal DataSet; it is only serialised when asked for, in the chosen format
+lazy_download('Download Data', state_key(data_id, date1, date2), lambda: df.take(date_positions), "Data.csv",
+              formats = ("csv", "csv.gz", "parquet"))
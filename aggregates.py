@@ -0,0 +1,346 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+class CountCube:
+    """Row counts for every observed combination of a set of dimensions.
+
+    Charts are answered by slicing and rolling up the cells, so their cost
+    depends on the number of distinct combinations, not on the number of rows.
+    """
+
+    max_slices = 32
+
+    def __init__(self, frame=None, dimensions=None, cells=None):
+        self.dimensions = list(dimensions)
+        if cells is None:
+            cells = (frame.groupby(self.dimensions, observed=True, dropna=False).size()
+                     .rename('count').reset_index())
+        self.cells = cells
+        self._lock = threading.Lock()
+        self._slices = OrderedDict()
+        self._histograms = {}
+
+    def slice(self, selection, ranges=None):
+        """Cube restricted to a {dimension: values} selection; None leaves a dimension open.
+
+        ranges optionally adds inclusive {dimension: (low, high)} bounds.
+        Recent slices are kept, so reruns that only move a slider reuse the
+        slice and any histograms already derived from it.
+        """
+        ranges = ranges or {}
+        key = (tuple((dim, None if values is None else tuple(values)) for dim, values in sorted(selection.items())),
+               tuple(sorted(ranges.items())))
+        with self._lock:
+            if key in self._slices:
+                self._slices.move_to_end(key)
+                return self._slices[key]
+        keep = np.ones(len(self.cells), dtype=bool)
+        for dim, values in selection.items():
+            if values is not None:
+                keep &= self.cells[dim].isin(values).to_numpy()
+        for dim, bounds in ranges.items():
+            if bounds is not None:
+                keep &= self.cells[dim].between(*bounds).fillna(False).to_numpy(dtype=bool)
+        cube = CountCube(dimensions=self.dimensions, cells=self.cells[keep])
+        with self._lock:
+            self._slices[key] = cube
+            if len(self._slices) > self.max_slices:
+                self._slices.popitem(last=False)
+        return cube
+
+    @property
+    def total(self):
+        return int(self.cells['count'].sum())
+
+    def rollup(self, dims):
+        """Counts summed over every dimension not in dims, like groupby(dims).size()."""
+        return self.cells.groupby(dims, observed=True)['count'].sum()
+
+    def value_counts(self, dim):
+        """Same result as frame[dim].value_counts() on the rows in the cube."""
+        counts = self.rollup(dim)
+        counts = counts[counts > 0].sort_values(ascending=False, kind='stable')
+        return counts.rename('count').rename_axis(dim)
+
+    def histogram(self, groups, dim):
+        """Unit-resolution histogram of dim per group, built once per cube."""
+        key = (tuple(groups), dim)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = UnitHistogram(self.cells, groups, dim)
+            return self._histograms[key]
+
+
+class UnitHistogram:
+    """Counts of an integer column at resolution 1, per group.
+
+    Any set of bin edges is answered from the running totals of these counts,
+    so changing an interval step costs O(groups x bins) instead of a pass
+    over the rows.
+    """
+
+    def __init__(self, cells, groups, dim):
+        cells = cells.dropna(subset=[dim])
+        # Group order follows groupby, so traces come out in the same order as before;
+        # like groupby, cells with a missing group value belong to no group
+        grouped = cells.groupby(groups, observed=True)
+        codes = grouped.ngroup()
+        cells = cells[codes.notna().to_numpy()]
+        codes = codes.dropna().to_numpy(dtype=np.int64)
+        self.groups = grouped.size().index
+        values = cells[dim].to_numpy(dtype=np.int64)
+        self.low = int(min(values.min(), 0)) if len(values) else 0
+        span = int(values.max()) - self.low + 1 if len(values) else 1
+        counts = np.zeros((len(self.groups), span), dtype=np.int64)
+        np.add.at(counts, (codes, values - self.low), cells['count'].to_numpy())
+        self.counts = counts
+        # cumulative[:, v] is the count of values below low + v
+        self.cumulative = np.concatenate([np.zeros((len(self.groups), 1), dtype=np.int64), counts.cumsum(axis=1)], axis=1)
+
+    def rebin(self, edges):
+        """Counts per group for the given bin edges, with np.histogram semantics.
+
+        Bins are half-open except the last, which includes its right edge.
+        Returns a Series of count arrays indexed by group.
+        """
+        return pd.Series(list(self._binned(edges)), index=self.groups, dtype=object)
+
+    def rebin_grid(self, edges):
+        """rebin() laid out as a (first level x second level x bin) count array.
+
+        Returns the row labels, the column labels and the array, in the order
+        rebin(edges).unstack(fill_value=0) would give; missing pairs count zero.
+        An empty cube gives no labels and a (0 x 0 x bin) array.
+        """
+        if not len(self.groups):
+            rows, columns = (pd.Index([], name=name) for name in self.groups.names[:2])
+            return rows, columns, np.zeros((0, 0, len(edges) - 1), dtype=np.int64)
+        binned = self._binned(edges)
+        slots = pd.Series(np.arange(len(self.groups)), index=self.groups).unstack()
+        grid = np.zeros(slots.shape + (binned.shape[1],), dtype=np.int64)
+        present = slots.notna().to_numpy()
+        grid[present] = binned[slots.to_numpy()[present].astype(np.int64)]
+        return slots.index, slots.columns, grid
+
+    def _binned(self, edges):
+        edges = np.asarray(edges, dtype=np.int64) - self.low
+        span = self.counts.shape[1]
+        upper = np.clip(edges[1:], 0, span)
+        upper[-1] = np.clip(edges[-1] + 1, 0, span)
+        lower = np.clip(edges[:-1], 0, span)
+        return self.cumulative[:, upper] - self.cumulative[:, lower]
+
+
+class _WaveletMatrix:
+    """k-th smallest value over any union of ranges of a static array.
+
+    Each level keeps the running count of zero bits of the value ranks, so a
+    query walks the levels once and only touches the range bounds: the cost
+    is O(ranges x log distinct values), independent of how long the ranges are.
+    """
+
+    def __init__(self, values):
+        self.uniques, ranks = np.unique(values, return_inverse=True)
+        self.n_levels = max(1, int(len(self.uniques) - 1).bit_length())
+        self.zero_ranks = []
+        self.zero_totals = []
+        current = ranks.astype(np.int64)
+        for level in range(self.n_levels):
+            bits = (current >> (self.n_levels - 1 - level)) & 1
+            zeros = bits == 0
+            self.zero_ranks.append(np.concatenate([[0], np.cumsum(zeros)]))
+            self.zero_totals.append(int(zeros.sum()))
+            current = np.concatenate([current[zeros], current[~zeros]])
+
+    def kth(self, starts, ends, k):
+        """k-th smallest (0-based) of the values in all [start, end) ranges together."""
+        rank = 0
+        for level in range(self.n_levels):
+            zero_starts = self.zero_ranks[level][starts]
+            zero_ends = self.zero_ranks[level][ends]
+            zeros = int((zero_ends - zero_starts).sum())
+            if k < zeros:
+                starts, ends = zero_starts, zero_ends
+            else:
+                k -= zeros
+                rank |= 1 << (self.n_levels - 1 - level)
+                starts = self.zero_totals[level] + starts - zero_starts
+                ends = self.zero_totals[level] + ends - zero_ends
+        return self.uniques[rank]
+
+
+class KpiEngine:
+    """Count, sum, median, max and min of a value column over any date window
+    and category selection of a date-sorted frame.
+
+    Rows are laid out by category combination, then by date, so a window is
+    one contiguous run per combination. Sums come from prefix sums and the
+    order statistics from a wavelet matrix over that layout, so a query costs
+    time in the number of selected combinations rather than rows.
+    """
+
+    def __init__(self, frame, dimensions, value):
+        self.dimensions = list(dimensions)
+        self.n_rows = len(frame)
+        codes = frame.groupby(self.dimensions, sort=False, observed=True, dropna=False).ngroup().to_numpy()
+        first = np.unique(codes, return_index=True)[1]
+        self.groups = frame[self.dimensions].take(first).reset_index(drop=True)
+
+        # Row keys ordered by (combination, date position); missing values are left out
+        order = np.argsort(codes, kind='stable')
+        self._row_keys = codes[order] * self.n_rows + order
+        values = frame[value].to_numpy(dtype=float, na_value=np.nan)[order]
+        valid = ~np.isnan(values)
+        self._value_keys = self._row_keys[valid]
+        values = values[valid]
+        self._sums = np.concatenate([[0.0], np.cumsum(values)])
+        self._order_stats = _WaveletMatrix(values) if len(values) else None
+
+    def _chosen(self, selection):
+        keep = np.ones(len(self.groups), dtype=bool)
+        for dim, values in selection.items():
+            if values is not None:
+                keep &= self.groups[dim].isin(values).to_numpy()
+        return np.flatnonzero(keep)
+
+    def summary(self, selection, lo=0, hi=None):
+        """KPIs for the rows lo:hi of the frame that match a {dimension: values} selection.
+
+        Matches frame.iloc[lo:hi] filtered with isin: count, sum, median, max
+        and min of the value column, with missing values skipped as pandas does.
+        """
+        hi = self.n_rows if hi is None else hi
+        base = self._chosen(selection) * self.n_rows
+        rows = np.searchsorted(self._row_keys, base + hi) - np.searchsorted(self._row_keys, base + lo)
+        starts = np.searchsorted(self._value_keys, base + lo)
+        ends = np.searchsorted(self._value_keys, base + hi)
+        n_values = int((ends - starts).sum())
+        kpis = {
+            'count': int(rows.sum()),
+            'sum': float((self._sums[ends] - self._sums[starts]).sum()),
+            'median': np.nan, 'max': np.nan, 'min': np.nan,
+        }
+        if n_values:
+            kth = self._order_stats.kth
+            kpis['min'] = kth(starts, ends, 0)
+            kpis['max'] = kth(starts, ends, n_values - 1)
+            kpis['median'] = (kth(starts, ends, (n_values - 1) // 2) + kth(starts, ends, n_values // 2)) / 2
+        return kpis
+
+
+def grouped_sums(frame, by, value, sort=False):
+    """frame reduced to one row per group of `by` with the summed value, for chart payloads.
+
+    Groups come in order of first appearance, as Plotly Express orders the
+    raw rows, or sorted by `by` with sort=True.
+    """
+    return frame.groupby(by, observed=True, sort=sort, as_index=False)[value].sum()
+
+
+def treemap_nodes(frame, path, value):
+    """Every node of a treemap over `path`, with its total, from one pass over the rows.
+
+    Returns one row per node with ids, labels, parents and the summed value,
+    for a treemap with branchvalues='total'. The last path column is carried
+    as the colour key: a node's leaf label when all its leaves share one,
+    otherwise '(?)', as Plotly Express colours mixed parents.
+    """
+    leaves = frame.groupby(path, observed=True, sort=False, as_index=False)[value].sum()
+    leaves[path] = leaves[path].astype(str)
+    color = path[-1]
+    levels = []
+    for depth in range(1, len(path) + 1):
+        keys = path[:depth]
+        level = leaves.groupby(keys, sort=False, as_index=False).agg(
+            **{value: (value, 'sum'), 'color': (color, lambda labels: labels.iloc[0] if labels.nunique() == 1 else '(?)')})
+        level['ids'] = level[keys].agg('/'.join, axis=1)
+        level['parents'] = level[keys[:-1]].agg('/'.join, axis=1) if depth > 1 else ''
+        level['labels'] = level[keys[-1]]
+        levels.append(level[['ids', 'labels', 'parents', value, 'color']])
+    nodes = pd.concat(levels, ignore_index=True)
+    return nodes.rename(columns={'color': color})
+
+
+class Rollup:
+    """Sum and count of a value column per date and combination of dimensions.
+
+    Built once per dataset at two resolutions: per order date and per month.
+    The cells stand in for the rows in time series and pivots. A date range
+    is a contiguous run of the date-ordered cells; whole months inside it
+    are read from the monthly cells, and any coarser bucket or grouping is a
+    groupby over those few cells instead of over every row.
+    """
+
+    def __init__(self, frame, date, dimensions, value):
+        self.date = date
+        self.dimensions = list(dimensions)
+        self.value = value
+        cells = (frame.groupby([date] + self.dimensions, observed=True, dropna=False)[value]
+                 .agg(['sum', 'count']).reset_index())
+        # Missing dates never fall inside a range, so they get no cells
+        self.daily = cells[cells[date].notna()].sort_values(date, kind='stable', ignore_index=True)
+        months = self.daily[date].dt.to_period('M').dt.start_time.rename(date)
+        self.monthly = (self.daily.groupby([months] + self.dimensions, observed=True, dropna=False)[['sum', 'count']]
+                        .sum().reset_index())
+        self._daily_dates = self.daily[date].to_numpy(dtype='datetime64[ns]')
+        self._monthly_dates = self.monthly[date].to_numpy(dtype='datetime64[ns]')
+
+    @staticmethod
+    def _run(cells, dates, start, end, inclusive=True):
+        # Cells with start <= date <= end (date < end when not inclusive)
+        lo = int(dates.searchsorted(np.datetime64(start, 'ns'), side='left'))
+        hi = int(dates.searchsorted(np.datetime64(end, 'ns'), side='right' if inclusive else 'left'))
+        return cells.iloc[lo:max(lo, hi)]
+
+    def select(self, selection, start=None, end=None, monthly=False):
+        """Cells with start <= date <= end matching a {dimension: values} selection.
+
+        With monthly=True, the months lying wholly inside the range come as
+        one cell per month, dated on its first day, so only use it when the
+        caller buckets by month or coarser.
+        """
+        if not len(self.daily):
+            return self.daily
+        start = pd.Timestamp(self._daily_dates[0] if start is None else start)
+        end = pd.Timestamp(self._daily_dates[-1] if end is None else end)
+        parts = [(self.daily, self._daily_dates, start, end, True)]
+        if monthly:
+            # Whole months are those from the first month start at or after start
+            # up to the last month start at or before the instant after end
+            first = start.to_period('M').start_time
+            first = first if first == start else (start.to_period('M') + 1).start_time
+            stop = (end + pd.Timedelta(1, 'ns')).to_period('M').start_time
+            if first < stop:
+                parts = [(self.daily, self._daily_dates, start, first, False),
+                         (self.monthly, self._monthly_dates, first, stop, False),
+                         (self.daily, self._daily_dates, stop, end, True)]
+        cells = pd.concat([self._run(*part) for part in parts], ignore_index=True) if len(parts) > 1 \
+            else self._run(*parts[0])
+        keep = np.ones(len(cells), dtype=bool)
+        for dim, values in selection.items():
+            if values is not None:
+                keep &= cells[dim].isin(values).to_numpy()
+        return cells[keep]
+
+    def timeline(self, selection, start=None, end=None, freq='M'):
+        """Summed value per period of freq ('D', 'W', 'M', 'Q'), oldest first."""
+        cells = self.select(selection, start, end, monthly=freq in ('M', 'Q'))
+        periods = cells[self.date].dt.to_period(freq)
+        return cells.groupby(periods)['sum'].sum().rename(self.value)
+
+    def mean_table(self, selection, start=None, end=None, index=None, columns=None, monthly=False):
+        """Mean value with index down and columns across, like pivot_table(aggfunc='mean') on the rows.
+
+        columns may be a dimension or a function of the date column, such as
+        lambda dates: dates.dt.month_name(); pass monthly=True when it only
+        depends on the month. Rows and columns come sorted.
+        """
+        cells = self.select(selection, start, end, monthly)
+        across = columns(cells[self.date]) if callable(columns) else cells[columns]
+        totals = cells.groupby([cells[index], across], observed=True)[['sum', 'count']].sum()
+        means = (totals['sum'] / totals['count'].where(totals['count'] > 0)).unstack()
+        return means.dropna(how='all').dropna(axis=1, how='all').sort_index().sort_index(axis=1)
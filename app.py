@@ -4,19 +4,18 @@ import plotly.graph_objects as go
 import plotly.colors as colors
 from datetime import datetime
 from streamlit_extras.metric_cards import style_metric_cards
+from data_store import load_derived, load_workbook
+from filter_forms import apply_button, batch_toggle, carried, filter_form
+from filters import QueryPlanner
+from schema import COLPOSCOPY, observed_counts
+from stats import describe, describe_groups, rounded
 
 
-# Function to calculate summaries
+# Function to calculate summaries, all from one vectorised pass over the column
 def calculate_summaries(column):
-    mean = column.mean()
-    mode = column.mode().values
-    max_value = column.max()
-    min_value = column.min()
-    std_dev = column.std()
-    median = column.median()
-    count = len(column)
-    range_value = max_value - min_value
-    return mean, mode, max_value, min_value, std_dev, median, count,range_value
+    stats = describe(column)
+    whole = rounded(stats)
+    return stats['mean'], whole['mode'], whole['max'], whole['min'], stats['std'], stats['50%'], whole['count'], whole['range']
 
 # page layout
 st.set_page_config(page_title="Colposcopy Analytics", page_icon="🌎", layout="wide")
@@ -36,18 +35,27 @@ with open('style.css') as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
 # Read the data from Excel file
-df = pd.read_excel("colpo.xlsx")
-df.fillna("None", inplace=True)
+df = load_workbook("colpo.xlsx", schema=COLPOSCOPY)
+
+# Value counts and codes for the graph filters, built once per version of the workbook
+FILTER_COLUMNS = ["program", "location", "hpv16", "hpv18", "hpvdna", "Via_Results", "Colposcopic_impression", "HIV_STATUS", "age"]
+query_planner = load_derived("query_planner", lambda frame: QueryPlanner(frame, FILTER_COLUMNS), "colpo.xlsx", schema=COLPOSCOPY)
 
 # Sidebar filters for programs and locations
+# In batched mode each group of filters is a form whose selections apply together
+batch_filters = batch_toggle()
 st.sidebar.header("DISCRIPTIVE SUMMARY")
+summary_filters = filter_form("summary_filters", batch_filters)
 programs = df["program"].unique()
 programs = ["Select All"] + list(programs)
-selected_programs = st.sidebar.multiselect("Select Program", programs, default="Select All", key="programs")
+selected_programs = summary_filters.multiselect("Select Program", programs, key="programs",
+                                               default=carried("summary_filters", "programs", "Select All"))
 
 locations = df["location"].unique()
 locations = ["Select All"] + list(locations)
-selected_locations = st.sidebar.multiselect("Select Location", locations, default="Select All", key="locations")
+selected_locations = summary_filters.multiselect("Select Location", locations, key="locations",
+                                                default=carried("summary_filters", "locations", "Select All"))
+apply_button(summary_filters, batch_filters)
 
 # Filter the data based on selected programs and locations
 if "Select All" in selected_programs and "Select All" in selected_locations:
@@ -74,6 +82,10 @@ st.write(f"<span style='color: blue;'>Standard Deviation:</span> {std_dev_age}",
 st.write(f"<span style='color: blue;'>Median:</span> {median_age}", unsafe_allow_html=True)
 st.write(f"<span style='color: blue;'>Count:</span> {count_age}", unsafe_allow_html=True)
 
+# The same summaries per program, computed in one grouped pass
+with st.expander("Discriptive Summary for Age per Program"):
+    st.dataframe(describe_groups(filtered_df, "age", by="program"))
+
 # Display the filtered data
 #st.subheader("Filtered Data")
 #st.write(filtered_df)
@@ -105,53 +117,53 @@ HIV_STATUS_values = ["Select All"] + list(HIV_STATUS_values)
 age_values = ["Select All"] + list(age_values)
 
 # Multiselect to choose programs and locations
-selected_programs = st.sidebar.multiselect("Select Programs", program_values, default=["Select All"])
-selected_locations = st.sidebar.multiselect("Select Locations", location_values, default=["Select All"])
-selected_hpv16 = st.sidebar.multiselect("Select HPV16", hpv16_values, default=["Select All"])
-selected_hpv18 = st.sidebar.multiselect("Select HPV18", hpv16_values, default=["Select All"])
-selected_hpvdna = st.sidebar.multiselect("Select HPVDA", hpv16_values, default=["Select All"])
-selected_Via_Results = st.sidebar.multiselect("Select Via_Results", Via_Results_values, default=["Select All"])
-selected_Colposcopic_impression = st.sidebar.multiselect("Select Colposcopic_impression", Colposcopic_impression_values, default=["Select All"])
-selected_HIV_STATUS = st.sidebar.multiselect("Select HIV_STATUS", HIV_STATUS_values, default=["Select All"])
-selected_age = st.sidebar.multiselect("Select Age", age_values, default=["Select All"])
+graph_filters = filter_form("graph_filters", batch_filters)
+selected_programs = graph_filters.multiselect("Select Programs", program_values, key="graph_programs",
+                                              default=carried("graph_filters", "graph_programs", ["Select All"]))
+selected_locations = graph_filters.multiselect("Select Locations", location_values, key="graph_locations",
+                                               default=carried("graph_filters", "graph_locations", ["Select All"]))
+selected_hpv16 = graph_filters.multiselect("Select HPV16", hpv16_values, key="graph_hpv16",
+                                           default=carried("graph_filters", "graph_hpv16", ["Select All"]))
+selected_hpv18 = graph_filters.multiselect("Select HPV18", hpv16_values, key="graph_hpv18",
+                                           default=carried("graph_filters", "graph_hpv18", ["Select All"]))
+selected_hpvdna = graph_filters.multiselect("Select HPVDA", hpv16_values, key="graph_hpvdna",
+                                            default=carried("graph_filters", "graph_hpvdna", ["Select All"]))
+selected_Via_Results = graph_filters.multiselect("Select Via_Results", Via_Results_values, key="graph_Via_Results",
+                                                 default=carried("graph_filters", "graph_Via_Results", ["Select All"]))
+selected_Colposcopic_impression = graph_filters.multiselect("Select Colposcopic_impression", Colposcopic_impression_values, key="graph_Colposcopic_impression",
+                                                            default=carried("graph_filters", "graph_Colposcopic_impression", ["Select All"]))
+selected_HIV_STATUS = graph_filters.multiselect("Select HIV_STATUS", HIV_STATUS_values, key="graph_HIV_STATUS",
+                                                default=carried("graph_filters", "graph_HIV_STATUS", ["Select All"]))
+selected_age = graph_filters.multiselect("Select Age", age_values, key="graph_age",
+                                         default=carried("graph_filters", "graph_age", ["Select All"]))
+apply_button(graph_filters, batch_filters)
 
 # metrics
 
 
-# Filter the data based on selected programs and locations
-filtered_df = df.copy()
-
-if "Select All" not in selected_programs:
-    filtered_df = filtered_df[filtered_df["program"].isin(selected_programs)]
-
-if "Select All" not in selected_locations:
-    filtered_df = filtered_df[filtered_df["location"].isin(selected_locations)]
-
-if "Select All" not in selected_hpv16:
-    filtered_df = filtered_df[filtered_df["hpv16"].isin(selected_hpv16)]
-
-if "Select All" not in selected_hpv18:
-    filtered_df = filtered_df[filtered_df["hpv18"].isin(selected_hpv18)]
-
-if "Select All" not in selected_hpvdna:
-    filtered_df = filtered_df[filtered_df["hpvdna"].isin(selected_hpvdna)]
-
-if "Select All" not in selected_Via_Results:
-    filtered_df = filtered_df[filtered_df["Via_Results"].isin(selected_Via_Results)]
-
-if "Select All" not in selected_Colposcopic_impression:
-    filtered_df = filtered_df[filtered_df["Colposcopic_impression"].isin(selected_Colposcopic_impression)]
-
-if "Select All" not in selected_HIV_STATUS:
-    filtered_df = filtered_df[filtered_df["HIV_STATUS"].isin(selected_HIV_STATUS)]
+# Filter the data based on the selected values. The planner evaluates the
+# constrained filters most-selective-first and takes the rows once at the end.
+selection = {
+    "program": None if "Select All" in selected_programs else selected_programs,
+    "location": None if "Select All" in selected_locations else selected_locations,
+    "hpv16": None if "Select All" in selected_hpv16 else selected_hpv16,
+    "hpv18": None if "Select All" in selected_hpv18 else selected_hpv18,
+    "hpvdna": None if "Select All" in selected_hpvdna else selected_hpvdna,
+    "Via_Results": None if "Select All" in selected_Via_Results else selected_Via_Results,
+    "Colposcopic_impression": None if "Select All" in selected_Colposcopic_impression else selected_Colposcopic_impression,
+    "HIV_STATUS": None if "Select All" in selected_HIV_STATUS else selected_HIV_STATUS,
+    "age": None if "Select All" in selected_age else selected_age,
+}
+filtered_df, filter_plan = query_planner.select(df, selection, explain=True)
+
+with st.sidebar.expander("Filter plan"):
+    st.dataframe(filter_plan, hide_index=True)
 
-if "Select All" not in selected_age:
-    filtered_df = filtered_df[filtered_df["age"].isin(selected_age)]
 if filtered_df.empty:
     st.write("No data available for the selected programs and locations.")
 else:
     # Group the data by location and program and count the occurrences
-    grouped_data = filtered_df.groupby(["location", "program", "hpv16", "hpv18", "hpvdna", "Via_Results", "Colposcopic_impression", "HIV_STATUS", "age"]).size().reset_index(name="count")
+    grouped_data = filtered_df.groupby(["location", "program", "hpv16", "hpv18", "hpvdna", "Via_Results", "Colposcopic_impression", "HIV_STATUS", "age"], observed=True).size().reset_index(name="count")
 
     # Get a list of unique programs
     unique_programs = grouped_data["program"].unique()
@@ -169,7 +181,7 @@ else:
 
     # Create the grouped bar chart
     # Group the data by program, location, and count the number of people
-    program_location_count = filtered_df.groupby(['program', 'location']).size().reset_index(name='count')
+    program_location_count = filtered_df.groupby(['program', 'location'], observed=True).size().reset_index(name='count')
 
     # Create the grouped bar chart for people count per program and location
     fig_bar_program_location_count = go.Figure()
@@ -199,7 +211,7 @@ else:
     col1.plotly_chart(fig_bar_program_location_count, use_container_width=True)
 
     # Create the grouped bar for age
-    program_age_count = filtered_df.groupby(['program', 'age']).size().reset_index(name='count')
+    program_age_count = filtered_df.groupby(['program', 'age'], observed=True).size().reset_index(name='count')
 
     # Create the grouped bar chart for people count per program and location
     fig_bar_program_age_count = go.Figure()
@@ -230,7 +242,7 @@ else:
 
 
     # Count the programs
-    program_count = filtered_df["program"].value_counts()
+    program_count = observed_counts(filtered_df["program"])
 
     # Create the pie chart with the same colors as the bar chart for program count
     fig_pie_program = go.Figure(data=[go.Pie(labels=program_count.index, values=program_count.values, marker_colors=program_colors)])
@@ -245,7 +257,7 @@ else:
     colors_hpvdna = ['#2ca02c', '#ff7f0e', '#1f77b4']  # HPV DNA colors
 
     # Count the HPV16
-    hpv16_count = filtered_df["hpv16"].value_counts()
+    hpv16_count = observed_counts(filtered_df["hpv16"])
 
     # Create the pie chart for HPV16
     fig_pie_hpv16 = go.Figure(data=[go.Pie(labels=hpv16_count.index, values=hpv16_count.values)])
@@ -257,7 +269,7 @@ else:
     col4.plotly_chart(fig_pie_hpv16, use_container_width=True)
 
     # Count the HPV18
-    hpv18_count = filtered_df["hpv18"].value_counts()
+    hpv18_count = observed_counts(filtered_df["hpv18"])
 
     # Create the pie chart for HPV18
     fig_pie_hpv18 = go.Figure(data=[go.Pie(labels=hpv18_count.index, values=hpv18_count.values)])
@@ -269,7 +281,7 @@ else:
     col5.plotly_chart(fig_pie_hpv18, use_container_width=True)
 
     # Count the HPV DNA
-    hpvdna_count = filtered_df["hpvdna"].value_counts()
+    hpvdna_count = observed_counts(filtered_df["hpvdna"])
 
     # Create the pie chart for HPV DNA
     fig_pie_hpvdna = go.Figure(data=[go.Pie(labels=hpvdna_count.index, values=hpvdna_count.values)])
@@ -280,7 +292,7 @@ else:
     # Display the HPV DNA pie chart
     col6.plotly_chart(fig_pie_hpvdna, use_container_width=True)
 
-    via_results_count = filtered_df["Via_Results"].value_counts()
+    via_results_count = observed_counts(filtered_df["Via_Results"])
 
     # Create the pie chart for Via Results
     fig_pie_via_results = go.Figure(data=[go.Pie(labels=via_results_count.index, values=via_results_count.values)])
@@ -290,7 +302,7 @@ else:
     col7.plotly_chart(fig_pie_via_results, use_container_width=True)
 
     # Count the occurrences of program and Colposcopic_impression combinations
-    program_colposcopic_count = filtered_df["Colposcopic_impression"].value_counts()
+    program_colposcopic_count = observed_counts(filtered_df["Colposcopic_impression"])
 
     # Create the pie chart for program and Colposcopic_impression
     fig_pie_program_colposcopic = go.Figure(data=[go.Pie(labels= program_colposcopic_count.index, values=program_colposcopic_count.values)])
@@ -301,7 +313,7 @@ else:
     col8.plotly_chart(fig_pie_program_colposcopic, use_container_width=True)
 
     # Count the HIV_STATUS
-    HIV_STATUS_count = filtered_df["HIV_STATUS"].value_counts()
+    HIV_STATUS_count = observed_counts(filtered_df["HIV_STATUS"])
 
     # Create the pie chart for HPV DNA
     fig_pie_HIV_STATUS = go.Figure(data=[go.Pie(labels=HIV_STATUS_count.index, values=HIV_STATUS_count.values)])
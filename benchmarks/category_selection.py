@@ -0,0 +1,60 @@
+"""Category filters: df.query (the old path) against CategorySelector.
+
+Run from the repository root: python benchmarks/category_selection.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from filters import CategorySelector  # noqa: E402
+
+CITIES = ['Boston', 'New York', 'Los Angeles', 'San Diego']
+PRODUCTS = ['Carrot', 'Whole Wheat', 'Chocolate Chip', 'Arrowroot', 'Potato Chips',
+            'Oatmeal Raisin', 'Bran', 'Pretzels', 'Banana', 'Cheese Crackers', 'Blueberry']
+REGIONS = ['East', 'West']
+
+
+def sales(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'City': pd.Categorical(rng.choice(CITIES, n_rows)),
+        'Product': pd.Categorical(rng.choice(PRODUCTS, n_rows)),
+        'Region': pd.Categorical(rng.choice(REGIONS, n_rows)),
+        'TotalPrice': rng.random(n_rows) * 500,
+    })
+
+
+def query(df, city, category, region):
+    # The expression food.py used to evaluate on every rerun
+    return df.query("City==@city & Product==@category & Region ==@region")
+
+
+def main(sizes=(10_000, 1_000_000, 10_000_000), repeat=5):
+    cases = {
+        'defaults': {'City': CITIES, 'Product': PRODUCTS, 'Region': REGIONS},
+        'narrowed': {'City': CITIES[:2], 'Product': PRODUCTS[:3], 'Region': REGIONS},
+    }
+    print(f"{'rows':>12} {'case':>9} {'query()':>11} {'selector':>11} {'speed-up':>9}")
+    for n_rows in sizes:
+        df = sales(n_rows)
+        selector = CategorySelector(df, ['City', 'Product', 'Region'])
+        for name, selection in cases.items():
+            args = selection['City'], selection['Product'], selection['Region']
+            expected = query(df, *args)
+            assert selector.select(df, selection).index.equals(expected.index)
+
+            def best(statement):
+                return min(timeit.repeat(statement, number=1, repeat=repeat))
+
+            queried = best(lambda: query(df, *args))
+            selected = best(lambda: selector.select(df, selection))
+            print(f"{n_rows:>12,} {name:>9} {queried * 1e3:>9.2f}ms {selected * 1e3:>9.2f}ms "
+                  f"{queried / selected:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
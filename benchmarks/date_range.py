@@ -0,0 +1,49 @@
+"""Date-range selection: boolean masks (the old path) against DateIndex.
+
+Run from the repository root: python benchmarks/date_range.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from filters import DateIndex  # noqa: E402
+
+
+def orders(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2020-01-01', 'ns')
+    days = rng.integers(0, 4 * 365, n_rows).astype('timedelta64[D]')
+    return pd.DataFrame({
+        'OrderDate': start + days,
+        'City': pd.Categorical(rng.choice(['Boston', 'New York', 'Los Angeles', 'San Diego'], n_rows)),
+        'TotalPrice': rng.random(n_rows) * 500,
+    })
+
+
+def main(sizes=(10_000, 1_000_000, 10_000_000), repeat=5):
+    start, end = pd.Timestamp('2021-03-01'), pd.Timestamp('2022-06-30')
+    print(f"{'rows':>12} {'string mask':>12} {'datetime mask':>14} {'DateIndex':>10} {'speed-up':>9}")
+    for n_rows in sizes:
+        df = orders(n_rows)
+        index = DateIndex(df, 'OrderDate')
+        expected = df[(df['OrderDate'] >= start) & (df['OrderDate'] <= end)]
+        selected = index.select(start, end)
+        assert np.isclose(selected['TotalPrice'].sum(), expected['TotalPrice'].sum())
+        assert len(selected) == len(expected)
+
+        def best(statement):
+            return min(timeit.repeat(statement, number=1, repeat=repeat))
+
+        string_mask = best(lambda: df[(df['OrderDate'] >= str(start.date())) & (df['OrderDate'] <= str(end.date()))])
+        datetime_mask = best(lambda: df[(df['OrderDate'] >= start) & (df['OrderDate'] <= end)])
+        indexed = best(lambda: index.select(start, end))
+        print(f"{n_rows:>12,} {string_mask * 1e3:>10.2f}ms {datetime_mask * 1e3:>12.2f}ms "
+              f"{indexed * 1e3:>8.3f}ms {string_mask / indexed:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+# Built figures as JSON by (chart id, data fingerprint, parameters), most recently used last
+MAX_CACHED_FIGURES = 64
+_lock = threading.Lock()
+_figures = OrderedDict()
+
+
+class ChartRegistry:
+    """Charts declared as lazily built nodes over named aggregate inputs.
+
+    Declaring an input or a chart computes nothing. figure() builds a chart
+    only when it is shown, evaluating just the inputs it depends on (each at
+    most once per registry), and keeps the figure's JSON in a process-wide
+    LRU, so showing it again for the same data and slider values skips the
+    build. Every call returns a new Figure, which callers are free to modify.
+    """
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self._inputs = {}
+        self._values = {}
+        self._charts = {}
+
+    def input(self, name, compute):
+        """Declare an aggregate input, computed on first use by a chart."""
+        self._inputs[name] = compute
+
+    def chart(self, chart_id, inputs=()):
+        """Decorator declaring a chart built from the named inputs plus figure() parameters."""
+        def register(build):
+            self._charts[chart_id] = (build, tuple(inputs))
+            return build
+        return register
+
+    def _value(self, name):
+        if name not in self._values:
+            self._values[name] = self._inputs[name]()
+        return self._values[name]
+
+    def figure(self, chart_id, *params):
+        key = (chart_id, self.fingerprint, params)
+        with _lock:
+            cached = _figures.get(key)
+            if cached is not None:
+                _figures.move_to_end(key)
+        if cached is not None:
+            return pio.from_json(cached)
+        build, inputs = self._charts[chart_id]
+        figure = build(*[self._value(name) for name in inputs], *params)
+        with _lock:
+            _figures[key] = figure.to_json()
+            while len(_figures) > MAX_CACHED_FIGURES:
+                _figures.popitem(last=False)
+        return figure
+
+
+def stacked_bar_figure(rows, columns, counts, x_values, colors, layout):
+    """Stacked bars for a (row x column x bin) count array, built in one go.
+
+    One trace per (row, column) pair, named "row - column" and coloured by
+    cycling through colors, plus a total annotation above every bin. All
+    traces, totals and annotations go into a single Figure construction
+    instead of one add_trace/add_annotation call each. With no rows or
+    columns the figure keeps its axes and says there is no data.
+    """
+    counts = np.asarray(counts)
+    counts = counts.reshape(len(rows) * len(columns), counts.shape[-1])
+    names = [f"{row} - {column}" for row in rows for column in columns]
+    traces = [
+        dict(type='bar', x=x_values, y=y, name=name, marker=dict(color=colors[i % len(colors)]),
+             legendgroup=name, offsetgroup=name)
+        for i, (name, y) in enumerate(zip(names, counts.tolist()))
+    ]
+    totals = counts.sum(axis=0).tolist() if names else []
+    annotations = [dict(x=i, y=total, text=str(total), showarrow=False, yshift=10, font=dict(size=10))
+                   for i, total in enumerate(totals)]
+    if not names:
+        annotations = [dict(text="No data for the selected filters", xref='paper', yref='paper', x=0.5, y=0.5,
+                            showarrow=False, font=dict(size=14))]
+    layout = dict(layout, annotations=annotations, barmode='stack',
+                  xaxis=dict(tickmode='linear', tickvals=list(range(len(x_values))), ticktext=x_values))
+    return go.Figure(data=traces, layout=layout)
+
+
+def payload_size(figure):
+    """Bytes of figure JSON that st.plotly_chart sends to the browser."""
+    return len(figure.to_json())
+
+
+# Scatter point budgets: SVG up to the first, WebGL up to the second, reduced beyond it
+SCATTER_WEBGL_POINTS = 5_000
+SCATTER_MAX_POINTS = 50_000
+SCATTER_GRID_BINS = 200
+
+
+def _grid_cells(x, y, bins):
+    # Cell number of every point on a bins x bins grid over the data extent
+    def cell(values):
+        low, high = values.min(), values.max()
+        scale = bins / (high - low) if high > low else 0.0
+        return np.minimum(((values - low) * scale).astype(np.int64), bins - 1)
+    return cell(x) * bins + cell(y)
+
+
+def stratified_sample(x, y, budget, bins=SCATTER_GRID_BINS, seed=0):
+    """Sorted positions of at most budget points, spread over a bins x bins grid.
+
+    Every occupied cell keeps up to the same quota of randomly chosen points,
+    so sparse cells - the outliers - keep all of theirs and only dense cells
+    are thinned. The grid is coarsened first if more than half the budget
+    would go to one point per occupied cell. The seed keeps the sample
+    stable across reruns.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if len(x) <= budget:
+        return np.arange(len(x))
+    cells = _grid_cells(x, y, bins)
+    # Coarsen the grid until the occupied cells leave room to thin the dense ones
+    while bins > 1 and len(np.unique(cells)) > budget // 2:
+        bins //= 2
+        cells = _grid_cells(x, y, bins)
+    # Largest per-cell quota whose kept total still fits the budget: with the
+    # cell sizes ascending, a quota between counts[i] and counts[i + 1] keeps
+    # all of the first i + 1 cells and quota points of each of the others
+    counts = np.sort(np.bincount(cells))
+    counts = counts[counts > 0]
+    full = np.cumsum(counts)
+    capped = np.arange(len(counts) - 1, -1, -1)
+    i = np.searchsorted(full + counts * capped, budget, side='right') - 1
+    if i < 0:
+        quota = budget // len(counts)
+    else:
+        quota = (budget - full[i]) // capped[i] if capped[i] else counts[i]
+    # Rank the points of each cell in a random order and keep the first quota
+    shuffled = np.random.default_rng(seed).permutation(len(cells))
+    order = shuffled[np.argsort(cells[shuffled], kind='stable')]
+    sorted_cells = cells[order]
+    starts = np.flatnonzero(np.concatenate([[True], sorted_cells[1:] != sorted_cells[:-1]]))
+    ranks = np.arange(len(order)) - np.repeat(starts, np.diff(np.append(starts, len(order))))
+    return np.sort(order[ranks < quota])
+
+
+def _density_figure(x, y, bins):
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    counts = np.where(counts > 0, counts, np.nan)
+    return go.Figure(go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2, y=(y_edges[:-1] + y_edges[1:]) / 2, z=counts.T,
+        colorscale='Viridis', colorbar=dict(title='Orders'),
+        hovertemplate='x=%{x}<br>y=%{y}<br>orders=%{z}<extra></extra>'))
+
+
+def scatter_figure(frame, x, y, size=None, reduction='sample', webgl_points=None, max_points=None, bins=None):
+    """px.scatter that stays responsive however many rows frame has.
+
+    Up to webgl_points rows it is the plain SVG scatter; up to max_points it
+    switches to a WebGL trace. Beyond that, reduction='sample' plots a
+    stratified sample of max_points rows that keeps the outliers, and
+    reduction='density' plots order counts on a bins x bins grid instead.
+    A note on the chart says how far the points were reduced. Thresholds left
+    as None come from the SCATTER_* settings above.
+    """
+    import plotly.express as px
+
+    webgl_points = SCATTER_WEBGL_POINTS if webgl_points is None else webgl_points
+    max_points = SCATTER_MAX_POINTS if max_points is None else max_points
+    bins = SCATTER_GRID_BINS if bins is None else bins
+
+    n = len(frame)
+    if n <= max_points:
+        return px.scatter(frame, x=x, y=y, size=size, render_mode='webgl' if n > webgl_points else 'svg')
+
+    x_values = frame[x].to_numpy(dtype=float, na_value=np.nan)
+    y_values = frame[y].to_numpy(dtype=float, na_value=np.nan)
+    valid = np.flatnonzero(~(np.isnan(x_values) | np.isnan(y_values)))
+    if reduction == 'density':
+        figure = _density_figure(x_values[valid], y_values[valid], bins)
+        figure.update_layout(xaxis_title=x, yaxis_title=y)
+        note = f"{n:,} points binned into a {bins} x {bins} density grid"
+    else:
+        keep = valid[stratified_sample(x_values[valid], y_values[valid], max_points, bins)]
+        figure = px.scatter(frame.take(keep), x=x, y=y, size=size, render_mode='webgl')
+        note = f"Showing {len(keep):,} of {n:,} points (1 in {n / max(len(keep), 1):.1f}), outliers kept"
+    figure.add_annotation(text=note, xref='paper', yref='paper', x=1, y=1, xanchor='right', yanchor='bottom',
+                          showarrow=False, font=dict(size=11))
+    return figure
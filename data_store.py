@@ -0,0 +1,252 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from schema import COLPOSCOPY, FOOD_SALES, HISTOLOGY, apply_schema
+
+# Workbooks shipped with the dashboards, converted up front by build_snapshots()
+WORKBOOKS = [
+    ("histof.xlsx", 0, HISTOLOGY),
+    ("histology.xlsx", 0, HISTOLOGY),
+    ("colpo.xlsx", 0, COLPOSCOPY),
+    ("foodsales.xlsx", "FoodSales", FOOD_SALES),
+    ("data/histos.xlsx", 0, HISTOLOGY),
+]
+SNAPSHOT_DIR = ".snapshots"
+# Schema metadata key holding the fingerprint of the workbook a snapshot was built from
+SOURCE_KEY = b"source_fingerprint"
+
+# Frames handed out by the store are shallow copies of one shared frame.
+# With pandas copy-on-write a mutation in a page copies the touched column
+# instead of writing through to the frame every other session is reading.
+# The option is process-wide; setting it here, in the module that hands the
+# frames out, puts it in effect before any page can get one.
+pd.set_option("mode.copy_on_write", True)
+
+# _lock only guards the dictionaries below and is never held during I/O.
+# Parsing a workbook or building a derived structure holds that item's own
+# lock, so different workbooks load in parallel and each is built once.
+_lock = threading.Lock()
+_item_locks = {}
+_entries = {}
+_stats = {"hits": 0, "misses": 0}
+
+
+def _item_lock(key):
+    with _lock:
+        return _item_locks.setdefault(key, threading.RLock())
+
+
+def file_fingerprint(path, chunk_size=1 << 20):
+    """Return a blake2b digest of the file contents."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_key(path, sheet_name, schema, read_kwargs):
+    schema_name = schema["name"] if schema else None
+    return os.path.abspath(path), sheet_name, schema_name, tuple(sorted(read_kwargs.items()))
+
+
+def snapshot_path(path, sheet_name=0, schema=None, read_kwargs=None):
+    """Return the Arrow IPC sidecar location for a workbook sheet."""
+    directory, filename = os.path.split(os.path.abspath(path))
+    name = f"{os.path.splitext(filename)[0]}.{sheet_name}"
+    if schema:
+        name += "." + schema["name"]
+    if read_kwargs:
+        options = repr(tuple(sorted(read_kwargs.items()))).encode()
+        name += "." + hashlib.blake2b(options, digest_size=4).hexdigest()
+    return os.path.join(directory, SNAPSHOT_DIR, name + ".arrow")
+
+
+def _arrow_safe(frame):
+    # Excel date columns often mix real dates with free text; Arrow needs one
+    # type per column, so those are stored as text
+    frame = frame.copy()
+    for col in frame.columns:
+        if frame[col].dtype == object and pd.api.types.infer_dtype(frame[col], skipna=True) != "string":
+            frame[col] = frame[col].map(lambda v: v if pd.isna(v) else str(v))
+    frame.columns = [str(col) for col in frame.columns]
+    return frame
+
+
+def write_snapshot(path, sheet_name=0, schema=None, fingerprint=None, **read_kwargs):
+    """Parse a workbook sheet and write it to its Arrow IPC sidecar.
+
+    With a schema, categorical columns are stored dictionary-encoded and
+    integer columns at their declared width. The workbook's content
+    fingerprint (computed if not given) is stored in the file's metadata.
+    """
+    # Hashed before parsing: if the workbook changes meanwhile, the stored
+    # fingerprint is the stale one and the next read rebuilds the snapshot
+    fingerprint = file_fingerprint(path) if fingerprint is None else fingerprint
+    frame = _arrow_safe(pd.read_excel(path, sheet_name=sheet_name, **read_kwargs))
+    if schema:
+        frame = apply_schema(frame, schema)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, SOURCE_KEY: fingerprint.encode()})
+    target = snapshot_path(path, sheet_name, schema, read_kwargs)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Write next to the target and swap in, so readers never see a partial file.
+    # The file stays uncompressed so it can be memory-mapped as is.
+    tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, target)
+    return target
+
+
+def snapshot_source(target):
+    """Fingerprint of the workbook a snapshot was built from, or None if there is no usable snapshot."""
+    try:
+        with pa.memory_map(target, "r") as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    source = metadata.get(SOURCE_KEY)
+    return None if source is None else source.decode()
+
+
+def map_snapshot(target):
+    """Memory-map an Arrow IPC snapshot and wrap it in a read-only DataFrame.
+
+    Fixed-width columns without nulls are zero-copy views onto the mapping, so
+    every process that maps the same file shares one copy of those pages
+    through the OS page cache.
+    """
+    with pa.memory_map(target, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    # split_blocks keeps one block per column; consolidating would copy
+    frame = table.to_pandas(split_blocks=True)
+    # Arrow hands back missing strings as None; the pages expect NaN like read_excel gives
+    for col in frame.columns[frame.dtypes == object]:
+        frame[col] = frame[col].where(frame[col].notna(), np.nan)
+    return frame
+
+
+def read_snapshot(path, sheet_name=0, schema=None, fingerprint=None, **read_kwargs):
+    """Map a sheet's snapshot, rebuilding it first unless it was built from this workbook content.
+
+    The check compares content fingerprints rather than modification times,
+    so a workbook replaced by a copy with an older or preserved mtime is
+    still picked up.
+    """
+    target = snapshot_path(path, sheet_name, schema, read_kwargs)
+    fingerprint = file_fingerprint(path) if fingerprint is None else fingerprint
+    if snapshot_source(target) != fingerprint:
+        write_snapshot(path, sheet_name, schema, fingerprint, **read_kwargs)
+    frame = map_snapshot(target)
+    # Arrow has no nullable-int pandas mapping by default; re-applying the
+    # schema turns those back from float64 and is a no-op for everything else
+    return apply_schema(frame, schema) if schema else frame
+
+
+def build_snapshots(workbooks=WORKBOOKS):
+    for path, sheet_name, schema in workbooks:
+        target = write_snapshot(path, sheet_name, schema)
+        print(f"{path} [{sheet_name}] -> {target}")
+
+
+def load_workbook(path, sheet_name=0, schema=None, **read_kwargs):
+    """Load an Excel sheet through the shared, cross-session cache.
+
+    Entries are validated against the file's modification time and size on
+    every call; the contents are only re-hashed when those change, and the
+    sheet is only re-read when the content fingerprint changes too. Reads go
+    through the sheet's memory-mapped Arrow snapshot rather than the xlsx.
+    Pass one of the schemas from schema.py to get compact column types.
+    """
+    key = _cache_key(path, sheet_name, schema, read_kwargs)
+    stat = os.stat(path)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and (entry["mtime_ns"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+            _stats["hits"] += 1
+            return entry["frame"].copy(deep=False)
+
+    with _item_lock(key):
+        # Another session may have loaded this version while we waited
+        with _lock:
+            entry = _entries.get(key)
+        if entry is not None and (entry["mtime_ns"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+            with _lock:
+                _stats["hits"] += 1
+            return entry["frame"].copy(deep=False)
+
+        fingerprint = file_fingerprint(path)
+        if entry is not None and entry["fingerprint"] == fingerprint:
+            # Touched but unchanged: keep the parsed frame, refresh the stat
+            with _lock:
+                entry["mtime_ns"], entry["size"] = stat.st_mtime_ns, stat.st_size
+                _stats["hits"] += 1
+            return entry["frame"].copy(deep=False)
+
+        frame = read_snapshot(path, sheet_name, schema, fingerprint, **read_kwargs)
+        with _lock:
+            _entries[key] = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "fingerprint": fingerprint,
+                "frame": frame,
+                "derived": {},
+            }
+            _stats["misses"] += 1
+        return frame.copy(deep=False)
+
+
+def load_derived(name, build, path, sheet_name=0, schema=None, **read_kwargs):
+    """Return build(frame) for the current version of a workbook.
+
+    The result is computed once per file version, shared across sessions and
+    dropped together with the frame when the workbook changes. Use it for
+    indexes and aggregates that are expensive to derive from the rows.
+    build() runs without the store's lock held, so it may load other
+    workbooks or derived structures itself.
+    """
+    load_workbook(path, sheet_name, schema, **read_kwargs)
+    key = _cache_key(path, sheet_name, schema, read_kwargs)
+    with _lock:
+        entry = _entries[key]
+        if name in entry["derived"]:
+            return entry["derived"][name]
+    with _item_lock((key, name)):
+        with _lock:
+            if name in entry["derived"]:
+                return entry["derived"][name]
+        value = build(entry["frame"])
+        with _lock:
+            # Kept with the version it was built from; a newer version rebuilds it
+            entry["derived"][name] = value
+        return value
+
+
+def dataset_version(path, sheet_name=0, schema=None, **read_kwargs):
+    """Content fingerprint of the workbook version currently served by load_workbook()."""
+    load_workbook(path, sheet_name, schema, **read_kwargs)
+    with _lock:
+        return _entries[_cache_key(path, sheet_name, schema, read_kwargs)]["fingerprint"]
+
+
+def cache_stats():
+    """Return hit/miss counters and the number of cached frames."""
+    with _lock:
+        return {"hits": _stats["hits"], "misses": _stats["misses"], "entries": len(_entries)}
+
+
+def clear_cache():
+    with _lock:
+        _entries.clear()
+        _stats["hits"] = 0
+        _stats["misses"] = 0
+
+
+if __name__ == "__main__":
+    build_snapshots()
@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import streamlit as st
+import xlsxwriter
+
+EXCEL_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Download formats: file extension and MIME type
+DOWNLOAD_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'csv.gz': ('.csv.gz', 'application/gzip'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+}
+
+# Finished downloads by (filter-state key, format), most recently used last,
+# bounded both in number and in total bytes
+MAX_CACHED_EXPORTS = 16
+MAX_CACHED_EXPORT_BYTES = 256 * 1024 * 1024
+# Rows converted to Python values at a time when writing a workbook
+EXCEL_CHUNK_ROWS = 10_000
+_lock = threading.Lock()
+_exports = OrderedDict()
+
+
+def state_key(*parts):
+    """Stable key for a dataset version plus filter state."""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def _column_values(series):
+    # Native Python values per column; missing values become blank cells
+    values = series.astype(object)
+    return values.where(series.notna(), None).tolist()
+
+
+def excel_bytes(frame, title):
+    """Write frame under a merged title block to an xlsx file and return its bytes.
+
+    Rows are streamed in order with constant_memory, so the writer only keeps
+    one row in memory, and are converted to Python values EXCEL_CHUNK_ROWS
+    at a time, so at most one chunk exists as objects besides the frame.
+    Numbers stay numbers instead of text.
+    """
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Sheet1')
+
+    # Merge cells for the title
+    title_format = workbook.add_format({
+        'bold': True,
+        'align': 'center',
+        'valign': 'vcenter',
+        'font_size': 10,
+        'text_wrap': True
+    })
+    worksheet.merge_range('A1:G5', title, title_format)
+
+    # Write the column headers
+    header_format = workbook.add_format({'bold': True})
+    worksheet.write_row(5, 0, [str(col) for col in frame.columns], header_format)
+
+    # Write the data row by row from per-column value lists, one chunk of rows at a time
+    for start in range(0, len(frame), EXCEL_CHUNK_ROWS):
+        chunk = frame.iloc[start:start + EXCEL_CHUNK_ROWS]
+        columns = [_column_values(chunk[col]) for col in chunk.columns]
+        for row_idx, row in enumerate(zip(*columns), start=6 + start):
+            worksheet.write_row(row_idx, 0, row)
+
+    workbook.close()
+    return output.getvalue()
+
+
+def _cached(key):
+    with _lock:
+        if key in _exports:
+            _exports.move_to_end(key)
+            return _exports[key]
+    return None
+
+
+def _store(key, content):
+    with _lock:
+        _exports[key] = content
+        size = sum(len(value) for value in _exports.values())
+        # Evict least recently used files, but always keep the one just built
+        while len(_exports) > 1 and (len(_exports) > MAX_CACHED_EXPORTS or size > MAX_CACHED_EXPORT_BYTES):
+            size -= len(_exports.popitem(last=False)[1])
+    return content
+
+
+def cached_excel(key, frame, title):
+    """excel_bytes() memoised by key; only call it once the user asks for the file."""
+    content = _cached((key, 'xlsx'))
+    return content if content is not None else _store((key, 'xlsx'), excel_bytes(frame, title))
+
+
+def encode(frame, fmt):
+    """frame as the bytes of a download in one of DOWNLOAD_FORMATS, without the index."""
+    if fmt == 'parquet':
+        output = io.BytesIO()
+        frame.to_parquet(output, index=False)
+        return output.getvalue()
+    content = frame.to_csv(index=False).encode('utf-8')
+    return gzip.compress(content) if fmt == 'csv.gz' else content
+
+
+def lazy_download(label, key, produce, file_name, formats=('csv',), **button_kwargs):
+    """A download button whose file is only built once the user asks for it.
+
+    produce() returns the DataFrame to download and is not called until the
+    "Prepare" button is pressed; the bytes are then cached by key (a
+    state_key() of the dataset version and filters) and format, so later
+    reruns with the same key show the download button straight away. The
+    shared cache can evict the file for other users' exports, so the session
+    also keeps the last file it prepared. file_name's extension is replaced
+    by the chosen format's. Meant for large frames; a small one is cheaper
+    to hand to st.download_button directly.
+    """
+    stem = os.path.splitext(file_name)[0]
+    fmt = formats[0]
+    if len(formats) > 1:
+        fmt = st.selectbox("Format", formats, key=f"{stem}_download_format", label_visibility="collapsed")
+    extension, mime = DOWNLOAD_FORMATS[fmt]
+    content = _cached((key, fmt))
+    prepared = st.session_state.get(f"{stem}_prepared")
+    if content is None and prepared is not None and prepared[:2] == (key, fmt):
+        content = prepared[2]
+    if content is None:
+        if not st.button(f"Prepare {stem}{extension}", key=f"{stem}_prepare"):
+            return
+        content = _store((key, fmt), encode(produce(), fmt))
+    st.session_state[f"{stem}_prepared"] = (key, fmt, content)
+    st.download_button(label, data=content, file_name=stem + extension, mime=mime, **button_kwargs)
@@ -0,0 +1,42 @@
+import streamlit as st
+
+
+def batch_toggle():
+    """Sidebar switch for applying the filter widgets together instead of one rerun per change."""
+    return st.sidebar.checkbox("Batch filter changes", key="batch_filters",
+                               help="Collect filter changes and apply them with one click")
+
+
+def filter_form(key, batched):
+    """Where to put a group of filter widgets: the sidebar, or a sidebar form when batched.
+
+    Widgets in a form don't rerun the page until its submit button is
+    pressed, so several selections cost one rerun; call apply_button() once
+    all of the group's widgets are placed. Moving a widget into or out of a
+    form makes it a new widget, so give each one a key and its default
+    through carried(), which keeps the selections across a mode switch.
+    """
+    previous = st.session_state.get(f"{key}_batched")
+    if previous is not None and previous != batched:
+        # The widgets still hold the last run's values; they become the new widgets' defaults
+        st.session_state[f"{key}_carried"] = {
+            widget_key: st.session_state[widget_key]
+            for widget_key in st.session_state.get(f"{key}_widgets", ()) if widget_key in st.session_state
+        }
+    st.session_state[f"{key}_batched"] = batched
+    st.session_state[f"{key}_widgets"] = set()
+    return st.sidebar.form(key) if batched else st.sidebar
+
+
+def carried(group, widget_key, default):
+    """Default for a keyed widget of a filter_form() group: its value before the last mode switch, if any.
+
+    The value only changes on a switch, so between switches the widget keeps its identity.
+    """
+    st.session_state[f"{group}_widgets"].add(widget_key)
+    return st.session_state.get(f"{group}_carried", {}).get(widget_key, default)
+
+
+def apply_button(container, batched):
+    if batched:
+        container.form_submit_button("Apply filters")
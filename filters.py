@@ -0,0 +1,371 @@
+import numpy as np
+import pandas as pd
+
+
+class BitmapIndex:
+    """One packed bitmap per distinct value of each filter column.
+
+    A selection ORs the bitmaps of the chosen values within a column, ANDs the
+    columns together and takes the matching rows once at the end, so no
+    intermediate frames are built however many filters are set.
+    """
+
+    def __init__(self, frame, columns):
+        self.n_rows = len(frame)
+        self._options = {}
+        self._positions = {}
+        self._na_position = {}
+        self._bitmaps = {}
+        for col in columns:
+            codes, uniques = pd.factorize(frame[col], use_na_sentinel=False)
+            values = list(uniques)
+            self._options[col] = values
+            self._positions[col] = {value: i for i, value in enumerate(values) if not pd.isna(value)}
+            self._na_position[col] = next((i for i, value in enumerate(values) if pd.isna(value)), None)
+            self._bitmaps[col] = [np.packbits(codes == i) for i in range(len(values))]
+
+    def options(self, col):
+        """Distinct values of a column, in order of first appearance like Series.unique()."""
+        return list(self._options[col])
+
+    def _position(self, col, value):
+        if pd.isna(value):
+            return self._na_position[col]
+        return self._positions[col].get(value)
+
+    def mask(self, selection):
+        """Packed bitmap of the rows matching a {column: values} selection.
+
+        A column mapped to None is left unconstrained; an empty list matches
+        nothing. Returns None when no column is constrained.
+        """
+        combined = None
+        for col, values in selection.items():
+            if values is None:
+                continue
+            column_mask = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+            for value in values:
+                position = self._position(col, value)
+                if position is not None:
+                    np.bitwise_or(column_mask, self._bitmaps[col][position], out=column_mask)
+            combined = column_mask if combined is None else np.bitwise_and(combined, column_mask, out=combined)
+        return combined
+
+    def positions(self, selection, within=None):
+        """Row positions matching a selection, or None when nothing is constrained.
+
+        within, if given, is a sorted array of candidate positions (e.g. from
+        a RangeFilter) that the result is restricted to.
+        """
+        combined = self.mask(selection)
+        if combined is None:
+            return within
+        if within is None:
+            return np.flatnonzero(np.unpackbits(combined, count=self.n_rows))
+        return within[np.unpackbits(combined, count=self.n_rows).view(bool)[within]]
+
+    def select(self, frame, selection, within=None):
+        positions = self.positions(selection, within)
+        return frame if positions is None else frame.take(positions)
+
+
+class RangeFilter:
+    """Numeric columns kept in argsort order, so an inclusive range is two binary searches.
+
+    The permutation is computed once; a range resolves to a slice of it,
+    and several ranges intersect through one boolean lookup over the rows.
+    """
+
+    def __init__(self, frame, columns):
+        self.n_rows = len(frame)
+        self._order = {}
+        self._sorted = {}
+        for col in columns:
+            values = frame[col].to_numpy(dtype=float, na_value=np.nan)
+            order = np.argsort(values, kind='stable')
+            # Missing values sort last and never fall inside a range
+            order = order[:self.n_rows - int(np.isnan(values).sum())]
+            self._order[col] = order
+            self._sorted[col] = values[order]
+
+    def bounds(self, col):
+        """Smallest and largest value of a column, as ints for the sliders."""
+        values = self._sorted[col]
+        return (int(values[0]), int(values[-1])) if len(values) else (0, 0)
+
+    def _slice(self, col, low, high):
+        values = self._sorted[col]
+        return self._order[col][values.searchsorted(low, side='left'):values.searchsorted(high, side='right')]
+
+    def positions(self, ranges):
+        """Sorted row positions with low <= value <= high for every {column: (low, high)}.
+
+        A column mapped to None is left unconstrained; returns None when none
+        is constrained.
+        """
+        positions = None
+        for col, bounds in ranges.items():
+            if bounds is None:
+                continue
+            rows = self._slice(col, *bounds)
+            if positions is not None:
+                keep = np.zeros(self.n_rows, dtype=bool)
+                keep[positions] = True
+                rows = rows[keep[rows]]
+            positions = rows
+        return None if positions is None else np.sort(positions)
+
+
+class QueryPlanner:
+    """Evaluates isin predicates most-selective-first from precomputed value counts.
+
+    Each column is factorized once; a predicate becomes a boolean lookup over
+    the column's codes. The first predicate yields the surviving row
+    positions and each later one only looks at those, so the cost shrinks as
+    the selection narrows and no intermediate frames are built.
+    """
+
+    def __init__(self, frame, columns):
+        self.n_rows = len(frame)
+        self._codes = {}
+        self._positions = {}
+        self._counts = {}
+        for col in columns:
+            codes, uniques = pd.factorize(frame[col], use_na_sentinel=False)
+            self._codes[col] = codes
+            self._positions[col] = {value: i for i, value in enumerate(uniques)}
+            self._counts[col] = np.bincount(codes, minlength=len(uniques))
+
+    def _lookup(self, col, values):
+        lookup = np.zeros(len(self._counts[col]), dtype=bool)
+        for value in values:
+            position = self._positions[col].get(value)
+            if position is not None:
+                lookup[position] = True
+        return lookup
+
+    def plan(self, selection):
+        """Constrained predicates as (column, lookup, estimated rows), most selective first."""
+        predicates = []
+        for col, values in selection.items():
+            if values is None:
+                continue
+            lookup = self._lookup(col, values)
+            predicates.append((col, lookup, int(self._counts[col][lookup].sum())))
+        return sorted(predicates, key=lambda predicate: predicate[2])
+
+    def _evaluate(self, selection):
+        positions = None
+        steps = []
+        for col, lookup, estimate in self.plan(selection):
+            codes = self._codes[col]
+            if positions is None:
+                positions = np.flatnonzero(lookup[codes])
+            else:
+                positions = positions[lookup[codes[positions]]]
+            steps.append((col, estimate, len(positions)))
+        return positions, steps
+
+    def positions(self, selection):
+        """Row positions matching a selection, or None when nothing is constrained."""
+        return self._evaluate(selection)[0]
+
+    def select(self, frame, selection, explain=False):
+        """Rows of frame matching a selection.
+
+        With explain=True, returns them together with explain()'s table from
+        the same evaluation, so showing the plan doesn't run it a second time.
+        """
+        positions, steps = self._evaluate(selection)
+        rows = frame if positions is None else frame.take(positions)
+        return (rows, self._explanation(steps)) if explain else rows
+
+    @staticmethod
+    def _explanation(steps):
+        return pd.DataFrame(steps, columns=["column", "estimated_rows", "rows_after"])
+
+    def explain(self, selection):
+        """The chosen predicate order with estimated and actual rows after each step."""
+        return self._explanation(self._evaluate(selection)[1])
+
+
+class HierarchyIndex:
+    """Row positions per leaf of a nested set of columns, e.g. Region > State > City.
+
+    Every row is coded once with its leaf (its distinct combination of the
+    levels). Option lists for cascading filters are read off the small table
+    of leaves, and a selection becomes a lookup over leaf codes, so neither
+    needs a copy or a scan of the frame's values.
+    """
+
+    def __init__(self, frame, levels):
+        self.levels = list(levels)
+        self.n_rows = len(frame)
+        codes = frame.groupby(self.levels, sort=False, observed=True, dropna=False).ngroup().to_numpy()
+        leaf_ids, first = np.unique(codes, return_index=True)
+        self._codes = codes
+        self.leaves = frame[self.levels].take(first).reset_index(drop=True)
+        self.leaves['first'] = first
+        # Rows of leaf i are _order[_offsets[i]:_offsets[i + 1]], in row order
+        self._order = np.argsort(codes, kind='stable')
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(leaf_ids)))])
+
+    def _leaves(self, positions):
+        # Leaves present among positions, with the first position each appears at
+        if positions is None or len(positions) == self.n_rows:
+            return self.leaves
+        # Writing in reverse leaves each leaf holding its earliest position
+        first = np.full(len(self.leaves), -1, dtype=np.int64)
+        first[self._codes[positions][::-1]] = positions[::-1]
+        leaf_ids = np.flatnonzero(first >= 0)
+        leaves = self.leaves.take(leaf_ids)
+        leaves['first'] = first[leaf_ids]
+        return leaves
+
+    def _chosen(self, leaves, selection):
+        keep = np.ones(len(leaves), dtype=bool)
+        for level, values in selection.items():
+            if values is not None:
+                keep &= leaves[level].isin(values).to_numpy()
+        return keep
+
+    def options(self, level, selection=None, positions=None):
+        """Values of level under a {level: values} selection of the levels above it.
+
+        Only rows in positions are considered when it is given. Values come in
+        order of first appearance, like Series.unique() on the filtered rows.
+        """
+        leaves = self._leaves(positions)
+        leaves = leaves[self._chosen(leaves, selection or {})]
+        return list(leaves.sort_values('first', kind='stable')[level].unique())
+
+    def positions(self, selection, positions=None):
+        """Row positions matching a selection, optionally within positions.
+
+        Returns positions unchanged (None meaning every row) when no level is constrained.
+        """
+        if all(values is None for values in selection.values()):
+            return positions
+        chosen = self._chosen(self.leaves, selection)
+        if positions is not None:
+            return positions[chosen[self._codes[positions]]]
+        leaf_ids = np.flatnonzero(chosen)
+        rows = [self._order[self._offsets[leaf]:self._offsets[leaf + 1]] for leaf in leaf_ids]
+        return np.sort(np.concatenate(rows)) if rows else np.array([], dtype=np.int64)
+
+    def select(self, frame, selection, positions=None):
+        positions = self.positions(selection, positions)
+        return frame if positions is None else frame.take(positions)
+
+
+class DateIndex:
+    """A frame sorted by a date column, so date ranges become contiguous slices.
+
+    bounds() resolves a range with two binary searches over the sorted
+    datetime64 values and select() returns the matching rows as a slice of
+    the sorted frame, without a comparison pass over every row.
+    """
+
+    def __init__(self, frame, column):
+        self.column = column
+        self.frame = frame.sort_values(column, kind='stable', ignore_index=True)
+        self.dates = self.frame[column].to_numpy(dtype='datetime64[ns]')
+        # Missing dates sort last and never fall inside a range
+        self._valid = len(self.dates) - int(np.isnat(self.dates).sum())
+
+    @property
+    def first(self):
+        return pd.Timestamp(self.dates[0]) if self._valid else pd.NaT
+
+    @property
+    def last(self):
+        return pd.Timestamp(self.dates[self._valid - 1]) if self._valid else pd.NaT
+
+    def bounds(self, start, end):
+        """(lo, hi) such that rows lo:hi are the ones with start <= date <= end."""
+        dates = self.dates[:self._valid]
+        lo = int(dates.searchsorted(np.datetime64(pd.Timestamp(start), 'ns'), side='left'))
+        hi = int(dates.searchsorted(np.datetime64(pd.Timestamp(end), 'ns'), side='right'))
+        return lo, max(lo, hi)
+
+    def positions(self, start, end):
+        return np.arange(*self.bounds(start, end))
+
+    def select(self, start, end):
+        lo, hi = self.bounds(start, end)
+        return self.frame.iloc[lo:hi]
+
+
+class CategorySelector:
+    """Compiled isin selections over categorical columns, optionally within a row window.
+
+    Each column is factorized once and keeps, per code, the sorted positions
+    of its rows. A selection becomes a boolean lookup over codes: a column
+    whose chosen values cover every row in the window is skipped outright,
+    the most selective remaining column gathers its rows from the per-code
+    position arrays and the others are checked only on those rows.
+    """
+
+    def __init__(self, frame, columns):
+        self.n_rows = len(frame)
+        self._codes = {}
+        self._positions = {}
+        self._keys = {}
+        self._rows = {}
+        for col in columns:
+            codes, uniques = pd.factorize(frame[col], use_na_sentinel=False)
+            order = np.argsort(codes, kind='stable')
+            self._codes[col] = codes
+            self._positions[col] = {value: i for i, value in enumerate(uniques)}
+            # Rows of code c are _rows[col][c*n <= _keys[col] < (c+1)*n], in row order
+            self._keys[col] = codes[order].astype(np.int64) * self.n_rows + order
+            self._rows[col] = order
+
+    def _lookup(self, col, values):
+        lookup = np.zeros(len(self._positions[col]), dtype=bool)
+        for value in values:
+            position = self._positions[col].get(value)
+            if position is not None:
+                lookup[position] = True
+        return lookup
+
+    def _bounds(self, col, codes, lo, hi):
+        # Where each code's rows inside lo:hi start and end in _rows[col]
+        base = codes.astype(np.int64) * self.n_rows
+        keys = self._keys[col]
+        return np.searchsorted(keys, base + lo), np.searchsorted(keys, base + hi)
+
+    def positions(self, selection, lo=0, hi=None):
+        """Row positions in lo:hi matching a {column: values} selection.
+
+        Returns None when no column narrows the window, i.e. every row of
+        lo:hi matches, which is the case for the all-selected defaults.
+        """
+        hi = self.n_rows if hi is None else hi
+        predicates = []
+        for col, values in selection.items():
+            if values is None:
+                continue
+            lookup = self._lookup(col, values)
+            starts, ends = self._bounds(col, np.arange(len(lookup)), lo, hi)
+            counts = ends - starts
+            chosen = int(counts[lookup].sum())
+            if chosen < counts.sum():
+                predicates.append((chosen, col, lookup))
+        if not predicates:
+            return None
+
+        predicates.sort(key=lambda predicate: predicate[0])
+        _, col, lookup = predicates[0]
+        starts, ends = self._bounds(col, np.flatnonzero(lookup), lo, hi)
+        rows = [self._rows[col][start:end] for start, end in zip(starts, ends)]
+        positions = np.sort(np.concatenate(rows)) if rows else np.array([], dtype=np.int64)
+        for _, col, lookup in predicates[1:]:
+            positions = positions[lookup[self._codes[col][positions]]]
+        return positions
+
+    def select(self, frame, selection, lo=0, hi=None):
+        positions = self.positions(selection, lo, hi)
+        if positions is None:
+            return frame.iloc[lo:hi]
+        return frame.take(positions)
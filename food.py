@@ -3,6 +3,10 @@ import pandas as pd
 import altair as alt
 from datetime import date, timedelta
 from streamlit_extras.metric_cards import style_metric_cards
+from data_store import load_workbook, load_derived
+from filters import CategorySelector, DateIndex
+from aggregates import KpiEngine
+from schema import FOOD_SALES
 
 # page layout
 st.set_page_config(page_title="Analytics", page_icon="🌎", layout="wide")
@@ -21,45 +25,55 @@ with open('style.css') as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
 # load dataset
-df = pd.read_excel("foodsales.xlsx", sheet_name="FoodSales")
+df = load_workbook("foodsales.xlsx", sheet_name="FoodSales", schema=FOOD_SALES)
+# sorted by OrderDate once per workbook version, so date ranges are binary searches
+date_index = load_derived("date_index", lambda frame: DateIndex(frame, "OrderDate"),
+                          "foodsales.xlsx", sheet_name="FoodSales", schema=FOOD_SALES)
+# TotalPrice KPIs per (City, Product, Region) along the date-sorted rows
+kpi_engine = load_derived("kpi_engine", lambda frame: KpiEngine(date_index.frame, ["City", "Product", "Region"], "TotalPrice"),
+                          "foodsales.xlsx", sheet_name="FoodSales", schema=FOOD_SALES)
+# per-value row positions of the sidebar filter columns
+selector = load_derived("selector", lambda frame: CategorySelector(date_index.frame, ["City", "Product", "Region"]),
+                        "foodsales.xlsx", sheet_name="FoodSales", schema=FOOD_SALES)
 
 # date filter
 start_date = st.sidebar.date_input("Start Date", date.today() - timedelta(days=365 * 4))
 end_date = st.sidebar.date_input(label="End Date")
 # compare date
-df2 = df[(df['OrderDate'] >= str(start_date)) & (df['OrderDate'] <= str(end_date))]
+lo, hi = date_index.bounds(start_date, end_date)
+df2 = date_index.frame.iloc[lo:hi]
 
 # sidebar switcher
 st.sidebar.header("Please filter")
 city = st.sidebar.multiselect(
     "Select City",
-    options=df2["City"].unique(),
-    default=df2["City"].unique(),
+    options=list(df2["City"].unique()),
+    default=list(df2["City"].unique()),
 )
 category = st.sidebar.multiselect(
     "Select Category",
-    options=df2["Product"].unique(),
-    default=df2["Product"].unique(),
+    options=list(df2["Product"].unique()),
+    default=list(df2["Product"].unique()),
 )
 region = st.sidebar.multiselect(
     "Select Region",
-    options=df2["Region"].unique(),
-    default=df2["Region"].unique(),
+    options=list(df2["Region"].unique()),
+    default=list(df2["Region"].unique()),
 )
 
-df_selection = df2.query(
-    "City==@city & Product==@category & Region ==@region"
-)
+selection = {"City": city, "Product": category, "Region": region}
+df_selection = selector.select(date_index.frame, selection, lo, hi)
 
-# metrics
+# metrics, resolved from the KPI engine for the same date window and selection
+kpis = kpi_engine.summary(selection, lo, hi)
 st.subheader('Key Performance')
 
 col1, col2, col3, col4 = st.columns(4)
-col1.metric(label="⏱ Total Items ", value=df_selection.Product.count(), delta="Number of Items in stock")
-col2.metric(label="⏱ Sum of Product Total Price USD:", value=f"{df_selection.TotalPrice.sum():,.0f}",
-            delta=df_selection.TotalPrice.median())
-col3.metric(label="⏱ Maximum Price  USD:", value=f"{df_selection.TotalPrice.max():,.0f}", delta="High Price")
-col4.metric(label="⏱ Minimum Price  USD:", value=f"{df_selection.TotalPrice.min():,.0f}", delta="Low Price")
+col1.metric(label="⏱ Total Items ", value=kpis["count"], delta="Number of Items in stock")
+col2.metric(label="⏱ Sum of Product Total Price USD:", value=f"{kpis['sum']:,.0f}",
+            delta=kpis["median"])
+col3.metric(label="⏱ Maximum Price  USD:", value=f"{kpis['max']:,.0f}", delta="High Price")
+col4.metric(label="⏱ Minimum Price  USD:", value=f"{kpis['min']:,.0f}", delta="Low Price")
 style_metric_cards(background_color="#00588E", border_left_color="#FF4B4B", border_color="#1f66bd",
                    box_shadow="#F71938")
 
@@ -91,7 +105,7 @@ def Progressbar():
         """<style>.stProgress > div > div > div > div { background-image: linear-gradient(to right, #99ff99 , #FFFF00)}</style>""",
         unsafe_allow_html=True, )
     target = 50000
-    current = df_selection["TotalPrice"].sum()
+    current = kpis["sum"]
     percent = round((current / target * 100))
     mybar = st.progress(0)
     if percent > 100:
@@ -1,4 +1,3 @@
-import io
 from datetime import datetime
 
 import numpy as np
@@ -9,6 +8,16 @@ import streamlit as st
 import xlsxwriter
 import openpyxl
 from openpyxl import Workbook
+from aggregates import CountCube
+from charts import ChartRegistry, stacked_bar_figure
+from data_store import dataset_version, load_derived, load_workbook
+from export import EXCEL_MIME, cached_excel, state_key
+from filter_forms import apply_button, batch_toggle, carried, filter_form
+from filters import BitmapIndex, RangeFilter
+from schema import HISTOLOGY
+from stats import describe, rounded
+from tables import paged_table
+
 # page layout
 
 st.set_page_config(page_title="ICI", page_icon="data/ici.png", layout="wide")
@@ -28,349 +37,289 @@ st.title("🔬 Histology Data Analysis")
 with open('style.css') as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 # Load the Excel file
-data = pd.read_excel('histof.xlsx')
+WORKBOOK = 'histof.xlsx'
+FILTER_COLUMNS = ['site', 'gender', 'age', 'sample_type', 'findings', 'days_gap']
+# age and days_gap are filtered by range, the others by value
+CATEGORY_COLUMNS = ['site', 'gender', 'sample_type', 'findings']
+RANGE_COLUMNS = ['age', 'days_gap']
+data = load_workbook(WORKBOOK, schema=HISTOLOGY)
+
 
 
+# Bitmap index over the categorical filter columns and argsort order of the
+# numeric ones, built once per version of the workbook
+filter_index = load_derived('category_index', lambda frame: BitmapIndex(frame, CATEGORY_COLUMNS), WORKBOOK, schema=HISTOLOGY)
+range_filter = load_derived('range_filter', lambda frame: RangeFilter(frame, RANGE_COLUMNS), WORKBOOK, schema=HISTOLOGY)
+# Counts over every observed combination of the filter columns, for the charts
+count_cube = load_derived('count_cube', lambda frame: CountCube(frame, FILTER_COLUMNS), WORKBOOK, schema=HISTOLOGY)
 
 # Get unique values from the 'site', 'gender', 'age', 'sample_type', 'findings' and 'days_gap' columns
-site_options = ['All'] + list(data['site'].unique())
-gender_options = ['All'] + list(data['gender'].unique())
-age_options = ['All'] + list(data['age'].unique())
-sample_type_options = ['All'] + list(data['sample_type'].unique())
-findings_options = ['All'] + list(data['findings'].unique())
-days_gap_options = ['All'] + list(data['days_gap'].unique())
+site_options = ['All'] + filter_index.options('site')
+gender_options = ['All'] + filter_index.options('gender')
+sample_type_options = ['All'] + filter_index.options('sample_type')
+findings_options = ['All'] + filter_index.options('findings')
+age_bounds = range_filter.bounds('age')
+days_gap_bounds = range_filter.bounds('days_gap')
 
 # Add a sidebar for site, gender, age, sample type, and findings selection
-selected_sites = st.sidebar.multiselect("Select Site", site_options, default=['All'])
-selected_gender = st.sidebar.multiselect("Select Gender", gender_options, default=['All'], key="gender_select")
-selected_age = st.sidebar.multiselect("Select Age", age_options, default=['All'], key="age_select")
-selected_sample_type = st.sidebar.multiselect("Select Sample Type", sample_type_options, default=['All'], key="sample_type_select")
-selected_findings = st.sidebar.multiselect("Select Findings", findings_options, default=['All'], key="findings_select")
-selected_days_gap = st.sidebar.multiselect("Select days_gap", days_gap_options, default=['All'], key="days_gap_select")
-# Filter the data based on the selected sites, gender, age, sample type, and findings days gaps
-if 'All' in selected_sites:
-    filtered_data = data
-else:
-    filtered_data = data[data['site'].isin(selected_sites)]
-
+# In batched mode the selections are collected in a form and applied together
+batch_filters = batch_toggle()
+filter_panel = filter_form("histo_filters", batch_filters)
+selected_sites = filter_panel.multiselect("Select Site", site_options, key="site_select",
+                                         default=carried("histo_filters", "site_select", ['All']))
+selected_gender = filter_panel.multiselect("Select Gender", gender_options, key="gender_select",
+                                          default=carried("histo_filters", "gender_select", ['All']))
+selected_age = filter_panel.slider("Select Age", *age_bounds, key="age_range",
+                                   value=carried("histo_filters", "age_range", age_bounds))
+selected_sample_type = filter_panel.multiselect("Select Sample Type", sample_type_options, key="sample_type_select",
+                                               default=carried("histo_filters", "sample_type_select", ['All']))
+selected_findings = filter_panel.multiselect("Select Findings", findings_options, key="findings_select",
+                                            default=carried("histo_filters", "findings_select", ['All']))
+selected_days_gap = filter_panel.slider("Select days_gap", *days_gap_bounds, key="days_gap_range",
+                                        value=carried("histo_filters", "days_gap_range", days_gap_bounds))
+apply_button(filter_panel, batch_filters)
+# Filter the data based on the selected sites, gender, age, sample type, and findings days gaps.
+# 'All' leaves a column unconstrained, as does a range slider left at its full extent.
+# The ranges resolve to row positions by binary search, the rows are taken once
+# from those and the combined bitmap, and the charts are served from the matching
+# slice of the count cube.
+selection = {
+    'site': None if 'All' in selected_sites else selected_sites,
+    'gender': None if 'All' in selected_gender else selected_gender,
+    'sample_type': None if 'All' in selected_sample_type else selected_sample_type,
+    'findings': None if 'All' in selected_findings else selected_findings,
+}
+ranges = {
+    'age': None if selected_age == age_bounds else selected_age,
+    'days_gap': None if selected_days_gap == days_gap_bounds else selected_days_gap,
+}
+filtered_data = filter_index.select(data, selection, range_filter.positions(ranges))
+
+# The range sliders can pick out values no row has; there is nothing to chart then
+if filtered_data.empty:
+    st.info("No records match the selected filters.")
+    st.stop()
+
+# Expand 'All' for the table title
 if 'All' in selected_gender:
     selected_gender = gender_options[1:]
 
-if 'All' in selected_age:
-    selected_age = age_options[1:]
-
 if 'All' in selected_sample_type:
     selected_sample_type = sample_type_options[1:]
 
 if 'All' in selected_findings:
     selected_findings = findings_options[1:]
 
-if 'All' in selected_days_gap:
-    selected_days_gap = days_gap_options[1:]
+print(filtered_data['age'].dtypes)
+filtered_cube = count_cube.slice(selection, ranges)
+
+# Charts are declared below and only built when their checkbox is ticked; built
+# figures are reused for the same data version, filters and slider values
+charts = ChartRegistry(state_key(dataset_version(WORKBOOK, schema=HISTOLOGY), selection, ranges))
+charts.input('site_count', lambda: filtered_cube.value_counts('site'))
+charts.input('gender_count', lambda: filtered_cube.value_counts('gender'))
+charts.input('age_count', lambda: filtered_cube.rollup(['site', 'gender', 'age']).unstack(fill_value=0))
+charts.input('sample_type_count', lambda: filtered_cube.value_counts('sample_type'))
+charts.input('findings_count', lambda: filtered_cube.value_counts('findings'))
+charts.input('days_gap_count', lambda: filtered_cube.rollup(['site', 'gender', 'days_gap']).unstack(fill_value=0))
+charts.input('age_histogram', lambda: filtered_cube.histogram(['site', 'gender'], 'age'))
+charts.input('day_histogram', lambda: filtered_cube.histogram(['site', 'gender'], 'days_gap'))
+
+
+@charts.chart('pie_site', inputs=['site_count'])
+def build_pie_site(site_count):
+    # Create the pie chart for site count with site colors
+    fig_pie_site = go.Figure(data=[go.Pie(labels=site_count.index, values=site_count.values)])
+    fig_pie_site.update_traces(marker=dict(colors=['rgb(255, 165, 0)', 'rgb(165, 42, 42)']))
+    fig_pie_site.update_layout(
+        title="SITES",
+    )
+    return fig_pie_site
 
 
-filtered_data = filtered_data[filtered_data['gender'].isin(selected_gender)]
-filtered_data = filtered_data[filtered_data['age'].isin(selected_age)]
-filtered_data = filtered_data[filtered_data['sample_type'].isin(selected_sample_type)]
-filtered_data = filtered_data[filtered_data['findings'].isin(selected_findings)]
-filtered_data = filtered_data[filtered_data['days_gap'].isin(selected_days_gap)]
-print(filtered_data['age'].dtypes)
-site_count = filtered_data['site'].value_counts()
-gender_count = filtered_data['gender'].value_counts()
-age_count = filtered_data.groupby(['site', 'gender', 'age']).size().unstack(fill_value=0)
-sample_type_count = filtered_data['sample_type'].value_counts()
-findings_count = filtered_data['findings'].value_counts()
-days_gap_count = filtered_data.groupby(['site', 'gender', 'days_gap']).size().unstack(fill_value=0)
-
-# Create the pie chart for site count with site colors
-fig_pie_site = go.Figure(data=[go.Pie(labels=site_count.index, values=site_count.values)])
-fig_pie_site.update_traces(marker=dict(colors=['rgb(255, 165, 0)', 'rgb(165, 42, 42)']))
-fig_pie_site.update_layout(
-    title="SITES",
-)
-
-# Create the pie chart for gender count with gender colors
-fig_pie_gender = go.Figure(data=[go.Pie(labels=gender_count.index, values=gender_count.values)])
-fig_pie_gender.update_traces(marker=dict(colors=['rgb(0, 128, 0)', 'rgb(0, 0, 255)']))
-fig_pie_gender.update_layout(
-    title="Gender",
-)
-
-# Create the grouped bar chart for age frequency with different colors
-fig_bar_age = go.Figure()
-
-# Assign the colors for sites and gender
-site_colors = ['rgb(255, 165, 0)', 'rgb(165, 42, 42)']
-gender_colors = ['rgb(0, 128, 0)', 'rgb(0, 0, 255)']
-bar_colors = ['rgb(255, 0, 0)', 'rgb(0, 255, 0)', 'rgb(0, 0, 255)', 'rgb(255, 255, 0)']
-
-for site in site_count.index:
-    for gender in gender_count.index:
-        if (site, gender) in age_count.index:
-            fig_bar_age.add_trace(go.Bar(
-                x=age_count.columns,
-                y=age_count.loc[(site, gender)],
-                name=f"{site} - {gender}",
-                marker_color=site_colors[0] if site == 'Site 1' else site_colors[1],
-                legendgroup=f"{site} - {gender}",
-            ))
-
-# Update the marker colors for each bar in the grouped bar chart
-for i, trace in enumerate(fig_bar_age.data):
-    trace.marker.color = bar_colors[i % len(bar_colors)]
-
-fig_bar_age.update_layout(
-    title="Age Frequency by Site and Gender",
-    xaxis_title="Age",
-    yaxis_title="Frequency"
-)
-
-# Set the desired step size for the age intervals
-age_interval_step = st.sidebar.slider('Age Grouping Interval Step', min_value=1, max_value=20, value=10)
+@charts.chart('pie_gender', inputs=['gender_count'])
+def build_pie_gender(gender_count):
+    # Create the pie chart for gender count with gender colors
+    fig_pie_gender = go.Figure(data=[go.Pie(labels=gender_count.index, values=gender_count.values)])
+    fig_pie_gender.update_traces(marker=dict(colors=['rgb(0, 128, 0)', 'rgb(0, 0, 255)']))
+    fig_pie_gender.update_layout(
+        title="Gender",
+    )
+    return fig_pie_gender
+
+
+@charts.chart('bar_age', inputs=['site_count', 'gender_count', 'age_count'])
+def build_bar_age(site_count, gender_count, age_count):
+    # Create the grouped bar chart for age frequency with different colors
+    fig_bar_age = go.Figure()
+
+    # Assign the colors for sites and gender
+    site_colors = ['rgb(255, 165, 0)', 'rgb(165, 42, 42)']
+    bar_colors = ['rgb(255, 0, 0)', 'rgb(0, 255, 0)', 'rgb(0, 0, 255)', 'rgb(255, 255, 0)']
+
+    for site in site_count.index:
+        for gender in gender_count.index:
+            if (site, gender) in age_count.index:
+                fig_bar_age.add_trace(go.Bar(
+                    x=age_count.columns,
+                    y=age_count.loc[(site, gender)],
+                    name=f"{site} - {gender}",
+                    marker_color=site_colors[0] if site == 'Site 1' else site_colors[1],
+                    legendgroup=f"{site} - {gender}",
+                ))
+
+    # Update the marker colors for each bar in the grouped bar chart
+    for i, trace in enumerate(fig_bar_age.data):
+        trace.marker.color = bar_colors[i % len(bar_colors)]
+
+    fig_bar_age.update_layout(
+        title="Age Frequency by Site and Gender",
+        xaxis_title="Age",
+        yaxis_title="Frequency"
+    )
+    return fig_bar_age
 
-# Generate age intervals based on the step size, starting from 5
-age_min = 0  # Start from 1
-age_max = 102  # Maximum age interval
-age_intervals = list(range(age_min, age_max + 1, age_interval_step))
 
-# Adjust the last interval to include ages up to 20
-if age_intervals[-1] != age_max:
-    age_intervals.append(age_max)
+@charts.chart('bar_ages', inputs=['age_histogram'])
+def build_bar_ages(age_histogram, age_interval_step):
+    # Generate age intervals based on the step size, starting from 5
+    age_min = 0  # Start from 1
+    age_max = 102  # Maximum age interval
+    age_intervals = list(range(age_min, age_max + 1, age_interval_step))
 
-# Calculate age count by site and gender
-age_count = filtered_data.groupby(['site', 'gender'])['age'].apply(lambda x: np.histogram(x, bins=age_intervals)[0]).unstack(fill_value=0)
+    # Adjust the last interval to include ages up to 20
+    if age_intervals[-1] != age_max:
+        age_intervals.append(age_max)
 
-# Create the stacked bar chart for age frequency
-fig_bar_ages = go.Figure()
+    # Counts as a (site x gender x interval) array
+    sites, genders, age_counts = age_histogram.rebin_grid(age_intervals)
 
-# Assign the colors for sites and genders
-site_colors = ['rgb(255, 165, 0)', 'rgb(165, 42, 42)', 'rgb(0, 128, 128)', 'rgb(128, 128, 0)', 'rgb(128, 0, 128)']
-gender_colors = {'MALE': 'rgb(0, 128, 0)', 'FEMALE': 'rgb(0, 0, 255)', 'OTHER': 'rgb(255, 0, 255)', 'UNKNOWN': 'rgb(128, 128, 128)'}
-bar_colors = ['rgb(255, 0, 0)', 'rgb(0, 255, 0)', 'rgb(0, 0, 255)', 'rgb(255, 255, 0)', 'rgb(128, 0, 128)']
+    # Interval labels; the last interval runs up to the maximum age
+    x_values = [f"{interval}-{interval + age_interval_step - 1}" for interval in age_intervals[:-1]]
+    x_values.append(f"{age_intervals[-2] + 1}-{age_max}")
+
+    # Create the stacked bar chart for age frequency, with every trace and total annotation in one go
+    bar_colors = ['rgb(255, 0, 0)', 'rgb(0, 255, 0)', 'rgb(0, 0, 255)', 'rgb(255, 255, 0)', 'rgb(128, 0, 128)']
+    fig_bar_ages = stacked_bar_figure(sites, genders, age_counts, x_values, bar_colors, dict(
+        title="Stacked Grouped Age Frequency by Site and Gender",
+        xaxis_title="Age Group interval",
+        yaxis_title="Frequency",
+    ))
+    return fig_bar_ages
 
 
-# Initialize lists to store x and y values
-x_values = []
-y_totals = []
+@charts.chart('bar_day', inputs=['day_histogram'])
+def build_bar_day(day_histogram, day_interval_step):
+    # Generate day intervals based on the step size, starting from 5
+    day_min = 0  # Start from 0
+    day_max = 280  # Maximum day interval
+    day_intervals = list(range(day_min, day_max + 1, day_interval_step))
 
-# Add the age values as stacked bars on the chart
-for site in age_count.index:
-    site_data = age_count.loc[site]
-    # Update x_values within the loop
-    x_values = [f"{interval}-{interval + age_interval_step - 1}" for interval in age_intervals[:-1]]
-    x_values.append(f"{age_intervals[-2] + 1}-{age_max}")  # Adjust the last interval to include the maximum age
-    for i, gender in enumerate(site_data.index):
-        if isinstance(site_data[gender], int):
-            y_values = [site_data[gender]] * len(age_intervals[:-1])
-        else:
-            y_values = site_data[gender].tolist()
-        fig_bar_ages.add_trace(go.Bar(
-            x=x_values,
-            y=y_values,
-            name=f"{site} - {gender}",
-            marker_color=gender_colors[gender],  # Use gender as a key to access color
-            legendgroup=f"{site} - {gender}",
-            offsetgroup=f"{site} - {gender}"
-        ))
-        # Calculate total for each group
-        if not y_totals:
-            y_totals = y_values.copy()
-        else:
-            for j, y_val in enumerate(y_values):
-                y_totals[j] += y_val
-
-# Update the marker colors for each bar in the stacked bar chart
-for i, trace in enumerate(fig_bar_ages.data):
-    trace.marker.color = bar_colors[i % len(bar_colors)]
-
-# Add total annotations to the chart
-for i, total in enumerate(y_totals):
-    fig_bar_ages.add_annotation(
-        x=i,
-        y=total,
-        text=str(total),
-        showarrow=False,
-        yshift=10,  # Adjust vertical position
-        font=dict(size=10)  # Adjust font size
-    )
+    # Adjust the last interval to include day up to 20
+    if day_intervals[-1] != day_max:
+        day_intervals.append(day_max)
 
-fig_bar_ages.update_layout(
-    title="Stacked Grouped Age Frequency by Site and Gender",
-    xaxis_title="Age Group interval",
-    yaxis_title="Frequency",
-    barmode='stack',  # Change the barmode to 'stack' for stacked bars
-    xaxis=dict(
-        tickmode='linear',
-        tickvals=list(range(len(x_values))),
-        ticktext=x_values
-    )
-)
+    # Counts as a (site x gender x interval) array
+    sites, genders, day_counts = day_histogram.rebin_grid(day_intervals)
 
-# Set the desired step size for the day intervals
-day_interval_step = st.sidebar.slider('Day Interval Step', min_value=0, max_value=20, value=10)
+    # Interval labels; the last interval runs up to the maximum day
+    x_values = [f"{interval}-{interval + day_interval_step - 1}" for interval in day_intervals[:-1]]
+    x_values.append(f"{day_intervals[-2] + 1}-{day_max}")
+
+    # Create the stacked bar chart for day frequency, with every trace and total annotation in one go
+    bar_colors = ['rgb(255, 165, 0)', 'rgb(165, 42, 42)', 'rgb(0, 128, 128)', 'rgb(128, 0, 128)', 'rgb(0, 255, 255)', 'rgb(255, 0, 255)']
+    fig_bar_day = stacked_bar_figure(sites, genders, day_counts, x_values, bar_colors, dict(
+        title="Stacked Grouped Day Frequency by Site and Gender",
+        xaxis_title="Day Group interval",
+        yaxis_title="Frequency",
+    ))
+    return fig_bar_day
 
-# Generate day intervals based on the step size, starting from 5
-day_min = 0  # Start from 0
-day_max = 280  # Maximum day interval
-day_intervals = list(range(day_min, day_max + 1, day_interval_step))
 
-# Adjust the last interval to include day up to 20
-if day_intervals[-1] != day_max:
-    day_intervals.append(day_max)
+@charts.chart('pie_sample_type', inputs=['sample_type_count'])
+def build_pie_sample_type(sample_type_count):
+    # Create the pie chart for sample type count with sample type colors
+    fig_pie_sample_type = go.Figure(data=[go.Pie(labels=sample_type_count.index, values=sample_type_count.values)])
+    fig_pie_sample_type.update_traces(marker=dict(colors=['rgb(255, 0, 0)', 'rgb(0, 255, 0)', 'rgb(0, 0, 255)']))
+    fig_pie_sample_type.update_layout(
+        title="SAMPLE TYPE",
+    )
+    return fig_pie_sample_type
 
-# Calculate day count by site and gender
-day_count = filtered_data.groupby(['site', 'gender'])['days_gap'].apply(lambda x: np.histogram(x, bins=day_intervals)[0]).unstack(fill_value=0)
 
-# Create the stacked bar chart for day frequency
-fig_bar_day = go.Figure()
+@charts.chart('pie_findings', inputs=['findings_count'])
+def build_pie_findings(findings_count):
+    # Create the pie chart for findings count
+    fig_pie_findings = go.Figure(data=[go.Pie(labels=findings_count.index, values=findings_count.values)])
+    fig_pie_findings.update_layout(
+        title="FINDINGS",
+    )
+    return fig_pie_findings
 
-# Assign the colors for sites and genders
-site_colors = ['rgb(255, 0, 0)', 'rgb(0, 128, 0)', 'rgb(0, 0, 255)', 'rgb(255, 255, 0)', 'rgb(128, 0, 128)']  # Update site colors
-gender_colors = {'MALE': 'rgb(0, 0, 255)', 'FEMALE': 'rgb(255, 165, 0)', 'OTHER': 'rgb(255, 0, 255)'}  # Update gender colors
-bar_colors = ['rgb(255, 165, 0)', 'rgb(165, 42, 42)', 'rgb(0, 128, 128)', 'rgb(128, 0, 128)', 'rgb(0, 255, 255)', 'rgb(255, 0, 255)']  # Update bar colors
 
+@charts.chart('bar_days_gap', inputs=['days_gap_count'])
+def build_bar_days_gap(days_gap_count):
+    # Create the grouped bar chart for days_gap frequency with different colors
+    fig_bar_days_gap = go.Figure()
 
-# Initialize lists to store x and y values
-x_values = []
-y_totals = []
+    # Get the number of unique combinations of sites and genders
+    num_groups = len(days_gap_count.index)
 
-# Add the day values as stacked bars on the chart
-for site in day_count.index:
-    site_data = day_count.loc[site]
-    # Update x_values within the loop
-    x_values = [f"{interval}-{interval + day_interval_step - 1}" for interval in day_intervals[:-1]]
-    x_values.append(f"{day_intervals[-2] + 1}-{day_max}")  # Adjust the last interval to include the maximum day
-    for i, gender in enumerate(site_data.index):
-        if isinstance(site_data[gender], int):
-            y_values = [site_data[gender]] * len(day_intervals[:-1])
-        else:
-            y_values = site_data[gender].tolist()
-        fig_bar_day.add_trace(go.Bar(
-            x=x_values,
-            y=y_values,
+    # Generate a color palette with the desired number of colors
+    days_gap_colors = sns.color_palette("husl", num_groups).as_hex()
+
+    for i, (site, gender) in enumerate(days_gap_count.index):
+        fig_bar_days_gap.add_trace(go.Bar(
+            x=days_gap_count.columns,
+            y=days_gap_count.loc[(site, gender)],
             name=f"{site} - {gender}",
-            marker_color=gender_colors[gender],  # Use gender as a key to access color
+            marker_color=days_gap_colors[i],
             legendgroup=f"{site} - {gender}",
-            offsetgroup=f"{site} - {gender}"
         ))
-        # Calculate total for each group
-        if not y_totals:
-            y_totals = y_values.copy()
-        else:
-            for j, y_val in enumerate(y_values):
-                y_totals[j] += y_val
-
-# Update the marker colors for each bar in the stacked bar chart
-for i, trace in enumerate(fig_bar_day.data):
-    trace.marker.color = bar_colors[i % len(bar_colors)]
-
-# Add total annotations to the chart
-for i, total in enumerate(y_totals):
-    fig_bar_day.add_annotation(
-        x=i,
-        y=total,
-        text=str(total),
-        showarrow=False,
-        yshift=10,  # Adjust vertical position
-        font=dict(size=10)  # Adjust font size
-    )
 
-fig_bar_day.update_layout(
-    title="Stacked Grouped Day Frequency by Site and Gender",
-    xaxis_title="Day Group interval",
-    yaxis_title="Frequency",
-    barmode='stack',  # Change the barmode to 'stack' for stacked bars
-    xaxis=dict(
-        tickmode='linear',
-        tickvals=list(range(len(x_values))),
-        ticktext=x_values
+    fig_bar_days_gap.update_layout(
+        title="Day_Gap Frequency by Site and Gender",
+        xaxis_title="Day_Gap",
+        yaxis_title="Frequency"
     )
-)
-
-
-# Create the pie chart for sample type count with sample type colors
-fig_pie_sample_type = go.Figure(data=[go.Pie(labels=sample_type_count.index, values=sample_type_count.values)])
-fig_pie_sample_type.update_traces(marker=dict(colors=['rgb(255, 0, 0)', 'rgb(0, 255, 0)', 'rgb(0, 0, 255)']))
-fig_pie_sample_type.update_layout(
-    title="SAMPLE TYPE",
-)
-
-# Create the pie chart for findings count
-fig_pie_findings = go.Figure(data=[go.Pie(labels=findings_count.index, values=findings_count.values)])
-fig_pie_findings.update_layout(
-    title="FINDINGS",
-)
-
-# Create the grouped bar chart for days_gap frequency with different colors
-fig_bar_days_gap = go.Figure()
-
-# Get the number of unique combinations of sites and genders
-num_groups = len(days_gap_count.index)
-
-# Generate a color palette with the desired number of colors
-days_gap_colors = sns.color_palette("husl", num_groups).as_hex()
-
-for i, (site, gender) in enumerate(days_gap_count.index):
-    fig_bar_days_gap.add_trace(go.Bar(
-        x=days_gap_count.columns,
-        y=days_gap_count.loc[(site, gender)],
-        name=f"{site} - {gender}",
-        marker_color=days_gap_colors[i],
-        legendgroup=f"{site} - {gender}",
-    ))
+    return fig_bar_days_gap
 
-fig_bar_days_gap.update_layout(
-    title="Day_Gap Frequency by Site and Gender",
-    xaxis_title="Day_Gap",
-    yaxis_title="Frequency"
-)
-# Define the layout for the first row
-col1, col2 = st.columns(2)
 
+# Set the desired step sizes for the age and day intervals
+age_interval_step = st.sidebar.slider('Age Grouping Interval Step', min_value=1, max_value=20, value=10)
+day_interval_step = st.sidebar.slider('Day Interval Step', min_value=0, max_value=20, value=10)
 
-# Display the pie chart for site count in the first row
-show_pie_site = st.sidebar.checkbox("Show Pie Chart for Site Count", value=True)
-if show_pie_site:
-    col1.plotly_chart(fig_pie_site, use_container_width=True)
 
-# Display the pie chart for gender counts in the first row
-show_pie_gender = st.sidebar.checkbox("Show Pie Chart for Gender Counts", value=True)
-if show_pie_gender:
-    col2.plotly_chart(fig_pie_gender, use_container_width=True)
+# Only the charts that are switched on get built; the registry builds each
+# one at most once for the same filters and step
+def chart_panel(container, chart_id, label, *params, **chart_kwargs):
+    if st.sidebar.checkbox(label, value=True):
+        container.plotly_chart(charts.figure(chart_id, *params), **chart_kwargs)
+
+
+# Define the layout for the first row
+col1, col2 = st.columns(2)
+
+# Display the pie charts for site count and gender counts in the first row
+chart_panel(col1, 'pie_site', "Show Pie Chart for Site Count", use_container_width=True)
+chart_panel(col2, 'pie_gender', "Show Pie Chart for Gender Counts", use_container_width=True)
 
 # Define the layout for the second row
 col3, col4 = st.columns(2)
 
-# Display the pie chart for sample type count in the second row
-show_pie_sample_type = st.sidebar.checkbox("Show Pie Chart for Sample Type Count", value=True)
-if show_pie_sample_type:
-    col3.plotly_chart(fig_pie_sample_type, use_container_width=True)
-
-# Display the pie chart for findings count in the second row
-show_pie_findings = st.sidebar.checkbox("Show Pie Chart for Findings Count", value=True)
-if show_pie_findings:
-    col4.plotly_chart(fig_pie_findings, use_container_width=True)
+# Display the pie charts for sample type count and findings count in the second row
+chart_panel(col3, 'pie_sample_type', "Show Pie Chart for Sample Type Count", use_container_width=True)
+chart_panel(col4, 'pie_findings', "Show Pie Chart for Findings Count", use_container_width=True)
 
 # Display the grouped bar chart for ages frequency
-show_bar_age = st.sidebar.checkbox("Show Bar Chart for Ages Frequency", value=True)
-if show_bar_age:
-    st.plotly_chart(fig_bar_age, use_container_width=True)
-
+chart_panel(st, 'bar_age', "Show Bar Chart for Ages Frequency", use_container_width=True)
 
 # Display the pie chart for findings counts
-show_bar_days_gap = st.sidebar.checkbox("Show Bar Chart for Findings Counts", value=True)
-if show_bar_days_gap:
-    st.plotly_chart(fig_bar_days_gap, use_container_width=True)
+chart_panel(st, 'bar_days_gap', "Show Bar Chart for Findings Counts", use_container_width=True)
 
-# Display the grouped bar chart
-show_bar_ages = st.sidebar.checkbox("Show Grouped Bar Chart for Age intervals", value=True)
-if show_bar_ages:
-    st.plotly_chart(fig_bar_ages)
-
-# Display the grouped bar chart for day frequency
-show_bar_day = st.sidebar.checkbox("Show Grouped Bar Chart for Day Intervals", value=True)
-if show_bar_day:
-    st.plotly_chart(fig_bar_day)
+# Display the grouped bar charts for age and day intervals
+chart_panel(st, 'bar_ages', "Show Grouped Bar Chart for Age intervals", age_interval_step)
+chart_panel(st, 'bar_day', "Show Grouped Bar Chart for Day Intervals", day_interval_step)
 
 
 
@@ -407,39 +356,14 @@ table_title = "Data for\n" + "\n".join(table_title_parts)
 # Prepare data for download
 export_df = filtered_data[selected_columns]
 
-# Prepare the Excel content
-excel_content = io.BytesIO()
-with pd.ExcelWriter(excel_content, engine='xlsxwriter') as writer:
-    workbook = writer.book
-    worksheet = workbook.add_worksheet('Sheet1')
-
-    # Merge cells for the title
-    title_format = workbook.add_format({
-        'bold': True,
-        'align': 'center',
-        'valign': 'vcenter',
-        'font_size': 10,
-        'text_wrap': True
-    })
-    worksheet.merge_range('A1:G5', table_title, title_format)
-
-    # Write the column headers
-    header_format = workbook.add_format({
-        'bold': True
-    })
-    for col_idx, header in enumerate(export_df.columns):
-        worksheet.write(5, col_idx, header, header_format)
-
-    # Write the data
-    for row_idx, row in enumerate(export_df.itertuples(), start=6):
-        for col_idx, value in enumerate(row[1:], start=0):
-            worksheet.write(row_idx, col_idx, str(value))  # Convert value to string
-
 # Display the table title
 st.write(table_title)
 
-# Display the table
-st.dataframe(export_df, width=800, height=600)
+# Display the table a page at a time; the key covers the page, data version, filters
+# and the exported columns and title, and caches both the sort orders and the workbook
+export_key = state_key('histo', dataset_version(WORKBOOK, schema=HISTOLOGY), selection, ranges,
+                       selected_columns, table_title)
+paged_table(export_df, "export_table", data_key=export_key, width=800, height=600)
 
 # Compute and display the grand total
 grand_total = filtered_data.shape[0]
@@ -447,105 +371,47 @@ st.write("TOTAL:", grand_total)
 
 # Download the data with title included
 if st.button("Download Data"):
+    # The workbook is only built on request, and reused for the same data version and filters
     # Download data as Excel
     st.download_button(
         label="Download Excel",
-        data=excel_content.getvalue(),
+        data=cached_excel(export_key, export_df, table_title),
         file_name='filtered_data.xlsx',
-        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        mime=EXCEL_MIME
     )
 
-# Filter out records with zero age for statistics calculation
-age_data_nonzero = filtered_table_data[filtered_table_data['age'] != 0]['age']
-
-# Calculate statistics for the 'age' column excluding zero values
-age_count = len(age_data_nonzero)
-age_mean = round(age_data_nonzero.mean(), 2)
-age_std = round(age_data_nonzero.std(), 2)
-age_min = int(age_data_nonzero.min())
-age_q1 = int(np.percentile(age_data_nonzero, 25))
-age_median = int(np.percentile(age_data_nonzero, 50))
-age_q3 = int(np.percentile(age_data_nonzero, 75))
-age_max = int(age_data_nonzero.max())
-age_range = age_max - age_min
-age_mode = int(age_data_nonzero.mode().values[0])
-
-
-# Calculate statistics for the 'days_gap' column
-days_gap_data = filtered_table_data['days_gap']
-days_gap_count = len(days_gap_data)
-days_gap_mean = round(sum(days_gap_data) / days_gap_count, 2)
-days_gap_std = round(np.sqrt(sum((x - days_gap_mean) ** 2 for x in days_gap_data) / days_gap_count), 2)
-days_gap_min = int(days_gap_data.min())
-days_gap_q1 = int(np.percentile(days_gap_data, 25))
-days_gap_median = int(np.percentile(days_gap_data, 50))
-days_gap_q3 = int(np.percentile(days_gap_data, 75))
-days_gap_max = int(days_gap_data.max())
-days_gap_range = days_gap_max - days_gap_min
-days_gap_mode = int(days_gap_data.mode().values[0])
-
-# Create a DataFrame for age statistics excluding zero values
-age_stats_formatted = pd.DataFrame({
-    'count': [age_count],
-    'mean': [age_mean],
-    'std': [age_std],
-    'min': [age_min],
-    '25%': [age_q1],
-    '50%': [age_median],
-    '75%': [age_q3],
-    'max': [age_max],
-    'range': [age_range],
-    'mode': [age_mode]
-})
-
-# Create a DataFrame for days_gaps statistics
-days_gap_stats_formatted = pd.DataFrame({
-    'count': [days_gap_count],
-    'mean': [days_gap_mean],
-    'std': [days_gap_std],
-    'min': [days_gap_min],
-    '25%': [days_gap_q1],
-    '50%': [days_gap_median],
-    '75%': [days_gap_q3],
-    'max': [days_gap_max],
-    'range': [days_gap_range],
-    'mode': [days_gap_mode]
-})
-
 # Function to remove decimal points and trailing zeros from integers
 def remove_decimal_zeros(value):
     if isinstance(value, int):
         return str(value)
     return str(value).rstrip('0').rstrip('.')
 
-# Format values in the statistics DataFrame
-age_stats_formatted = age_stats_formatted.applymap(remove_decimal_zeros)
-days_gap_stats_formatted = days_gap_stats_formatted.applymap(remove_decimal_zeros)
 
-# Display the statistics tables
+# Statistics are computed in one vectorised pass, only while their panel is shown
+def stats_panel(column, toggle_label, caption, download_label, file_name, **describe_kwargs):
+    if st.checkbox(toggle_label, value=True):
+        st.write(caption)
+        stats_formatted = pd.DataFrame([rounded(describe(filtered_table_data[column], **describe_kwargs))])
+        # Format values in the statistics DataFrame
+        stats_formatted = stats_formatted.applymap(remove_decimal_zeros)
+        stats_table = pd.DataFrame({'stat': stats_formatted.columns, 'Value': stats_formatted.values.flatten()})
+        st.markdown(stats_table.to_html(index=False), unsafe_allow_html=True)  # Display HTML table
+        # Add download feature for the statistics table
+        stats_csv = stats_table.to_csv(index=False, header=True)  # Convert DataFrame to CSV with headers
+        st.download_button(download_label, stats_csv, file_name=file_name)
+
+
+# Display the statistics tables: 'age' excluding zero values, and 'days_gap'
+# with the population standard deviation
 with col2:
-    show_age_stats = st.checkbox("Show Age Stats", value=True)
-    if show_age_stats:
-        st.write("Excluding Zero Values:")
-        age_stats_table = pd.DataFrame({'stat': age_stats_formatted.columns, 'Value': age_stats_formatted.values.flatten()})
-        age_stats_table_html = age_stats_table.to_html(index=False)  # Convert DataFrame to HTML table
-        st.markdown(age_stats_table_html, unsafe_allow_html=True)  # Display HTML table
-        # Add download feature for age statistics table
-        age_stats_csv = age_stats_table.to_csv(index=False, header=True)  # Convert DataFrame to CSV with headers
-        st.download_button("Download  CSV )", age_stats_csv, file_name='age_stats_excluding_zero.csv')
+    stats_panel('age', "Show Age Stats", "Excluding Zero Values:", "Download  CSV )",
+                'age_stats_excluding_zero.csv', exclude_zero=True)
     # Add a line separator
     st.markdown("---")
 
 with col3:
-    show_days_gap_stats = st.checkbox("Show Days Stats", value=True)
-    if show_days_gap_stats:
-        st.write("Stats for Days Gap:")
-        days_gap_stats_table = pd.DataFrame({'stat': days_gap_stats_formatted.columns, 'Value': days_gap_stats_formatted.values.flatten()})
-        days_gap_stats_table_html = days_gap_stats_table.to_html(index=False)  # Convert DataFrame to HTML table
-        st.markdown(days_gap_stats_table_html, unsafe_allow_html=True)  # Display HTML table
-        # Add download feature for days_gap statistics table
-        days_gap_stats_csv = days_gap_stats_table.to_csv(index=False, header=True)  # Convert DataFrame to CSV with headers
-        st.download_button("Download  CSV", days_gap_stats_csv, file_name='days_gap_stats.csv')
+    stats_panel('days_gap', "Show Days Stats", "Stats for Days Gap:", "Download  CSV",
+                'days_gap_stats.csv', ddof=0)
 
 
 
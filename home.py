@@ -8,7 +8,6 @@ theme_plotly = None
 
 # sidebar logo
 st.sidebar.image("data/ici.png")
-import io
 from datetime import datetime
 
 import numpy as np
@@ -19,6 +18,15 @@ import streamlit as st
 import xlsxwriter
 import openpyxl
 from openpyxl import Workbook
+from aggregates import CountCube
+from charts import stacked_bar_figure
+from data_store import dataset_version, load_derived, load_workbook
+from export import EXCEL_MIME, cached_excel, state_key
+from filters import BitmapIndex, RangeFilter
+from schema import HISTOLOGY
+from stats import describe, rounded
+from tables import paged_table
+
 # page layout
 
 
@@ -34,59 +42,77 @@ st.title("🔬 Histology Data Analysis")
 with open('style.css') as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 # Load the Excel file
-data = pd.read_excel('histology.xlsx')
+WORKBOOK = 'histology.xlsx'
+FILTER_COLUMNS = ['site', 'gender', 'age', 'sample_type', 'findings', 'days_gap']
+# age and days_gap are filtered by range, the others by value
+CATEGORY_COLUMNS = ['site', 'gender', 'sample_type', 'findings']
+RANGE_COLUMNS = ['age', 'days_gap']
+data = load_workbook(WORKBOOK, schema=HISTOLOGY)
+
 
 
+# Bitmap index over the categorical filter columns and argsort order of the
+# numeric ones, built once per version of the workbook
+filter_index = load_derived('category_index', lambda frame: BitmapIndex(frame, CATEGORY_COLUMNS), WORKBOOK, schema=HISTOLOGY)
+range_filter = load_derived('range_filter', lambda frame: RangeFilter(frame, RANGE_COLUMNS), WORKBOOK, schema=HISTOLOGY)
+# Counts over every observed combination of the filter columns, for the charts
+count_cube = load_derived('count_cube', lambda frame: CountCube(frame, FILTER_COLUMNS), WORKBOOK, schema=HISTOLOGY)
 
 # Get unique values from the 'site', 'gender', 'age', 'sample_type', 'findings' and 'days_gap' columns
-site_options = ['All'] + list(data['site'].unique())
-gender_options = ['All'] + list(data['gender'].unique())
-age_options = ['All'] + list(data['age'].unique())
-sample_type_options = ['All'] + list(data['sample_type'].unique())
-findings_options = ['All'] + list(data['findings'].unique())
-days_gap_options = ['All'] + list(data['days_gap'].unique())
+site_options = ['All'] + filter_index.options('site')
+gender_options = ['All'] + filter_index.options('gender')
+sample_type_options = ['All'] + filter_index.options('sample_type')
+findings_options = ['All'] + filter_index.options('findings')
+age_bounds = range_filter.bounds('age')
+days_gap_bounds = range_filter.bounds('days_gap')
 
 # Add a sidebar for site, gender, age, sample type, and findings selection
 selected_sites = st.sidebar.multiselect("Select Site", site_options, default=['All'])
 selected_gender = st.sidebar.multiselect("Select Gender", gender_options, default=['All'], key="gender_select")
-selected_age = st.sidebar.multiselect("Select Age", age_options, default=['All'], key="age_select")
+selected_age = st.sidebar.slider("Select Age", *age_bounds, value=age_bounds, key="age_range")
 selected_sample_type = st.sidebar.multiselect("Select Sample Type", sample_type_options, default=['All'], key="sample_type_select")
 selected_findings = st.sidebar.multiselect("Select Findings", findings_options, default=['All'], key="findings_select")
-selected_days_gap = st.sidebar.multiselect("Select days_gap", days_gap_options, default=['All'], key="days_gap_select")
-# Filter the data based on the selected sites, gender, age, sample type, and findings days gaps
-if 'All' in selected_sites:
-    filtered_data = data
-else:
-    filtered_data = data[data['site'].isin(selected_sites)]
-
+selected_days_gap = st.sidebar.slider("Select days_gap", *days_gap_bounds, value=days_gap_bounds, key="days_gap_range")
+# Filter the data based on the selected sites, gender, age, sample type, and findings days gaps.
+# 'All' leaves a column unconstrained, as does a range slider left at its full extent.
+# The ranges resolve to row positions by binary search, the rows are taken once
+# from those and the combined bitmap, and the charts are served from the matching
+# slice of the count cube.
+selection = {
+    'site': None if 'All' in selected_sites else selected_sites,
+    'gender': None if 'All' in selected_gender else selected_gender,
+    'sample_type': None if 'All' in selected_sample_type else selected_sample_type,
+    'findings': None if 'All' in selected_findings else selected_findings,
+}
+ranges = {
+    'age': None if selected_age == age_bounds else selected_age,
+    'days_gap': None if selected_days_gap == days_gap_bounds else selected_days_gap,
+}
+filtered_data = filter_index.select(data, selection, range_filter.positions(ranges))
+
+# The range sliders can pick out values no row has; there is nothing to chart then
+if filtered_data.empty:
+    st.info("No records match the selected filters.")
+    st.stop()
+
+# Expand 'All' for the table title
 if 'All' in selected_gender:
     selected_gender = gender_options[1:]
 
-if 'All' in selected_age:
-    selected_age = age_options[1:]
-
 if 'All' in selected_sample_type:
     selected_sample_type = sample_type_options[1:]
 
 if 'All' in selected_findings:
     selected_findings = findings_options[1:]
 
-if 'All' in selected_days_gap:
-    selected_days_gap = days_gap_options[1:]
-
-
-filtered_data = filtered_data[filtered_data['gender'].isin(selected_gender)]
-filtered_data = filtered_data[filtered_data['age'].isin(selected_age)]
-filtered_data = filtered_data[filtered_data['sample_type'].isin(selected_sample_type)]
-filtered_data = filtered_data[filtered_data['findings'].isin(selected_findings)]
-filtered_data = filtered_data[filtered_data['days_gap'].isin(selected_days_gap)]
 print(filtered_data['age'].dtypes)
-site_count = filtered_data['site'].value_counts()
-gender_count = filtered_data['gender'].value_counts()
-age_count = filtered_data.groupby(['site', 'gender', 'age']).size().unstack(fill_value=0)
-sample_type_count = filtered_data['sample_type'].value_counts()
-findings_count = filtered_data['findings'].value_counts()
-days_gap_count = filtered_data.groupby(['site', 'gender', 'days_gap']).size().unstack(fill_value=0)
+filtered_cube = count_cube.slice(selection, ranges)
+site_count = filtered_cube.value_counts('site')
+gender_count = filtered_cube.value_counts('gender')
+age_count = filtered_cube.rollup(['site', 'gender', 'age']).unstack(fill_value=0)
+sample_type_count = filtered_cube.value_counts('sample_type')
+findings_count = filtered_cube.value_counts('findings')
+days_gap_count = filtered_cube.rollup(['site', 'gender', 'days_gap']).unstack(fill_value=0)
 
 # Create the pie chart for site count with site colors
 fig_pie_site = go.Figure(data=[go.Pie(labels=site_count.index, values=site_count.values)])
@@ -143,74 +169,20 @@ age_intervals = list(range(age_min, age_max + 1, age_interval_step))
 if age_intervals[-1] != age_max:
     age_intervals.append(age_max)
 
-# Calculate age count by site and gender
-age_count = filtered_data.groupby(['site', 'gender'])['age'].apply(lambda x: np.histogram(x, bins=age_intervals)[0]).unstack(fill_value=0)
+# Counts as a (site x gender x interval) array
+sites, genders, age_counts = filtered_cube.histogram(['site', 'gender'], 'age').rebin_grid(age_intervals)
 
-# Create the stacked bar chart for age frequency
-fig_bar_ages = go.Figure()
+# Interval labels; the last interval runs up to the maximum age
+x_values = [f"{interval}-{interval + age_interval_step - 1}" for interval in age_intervals[:-1]]
+x_values.append(f"{age_intervals[-2] + 1}-{age_max}")
 
-# Assign the colors for sites and genders
-site_colors = ['rgb(255, 165, 0)', 'rgb(165, 42, 42)', 'rgb(0, 128, 128)', 'rgb(128, 128, 0)', 'rgb(128, 0, 128)']
-gender_colors = {'MALE': 'rgb(0, 128, 0)', 'FEMALE': 'rgb(0, 0, 255)', 'OTHER': 'rgb(255, 0, 255)', 'UNKNOWN': 'rgb(128, 128, 128)'}
+# Create the stacked bar chart for age frequency, with every trace and total annotation in one go
 bar_colors = ['rgb(255, 0, 0)', 'rgb(0, 255, 0)', 'rgb(0, 0, 255)', 'rgb(255, 255, 0)', 'rgb(128, 0, 128)']
-
-
-# Initialize lists to store x and y values
-x_values = []
-y_totals = []
-
-# Add the age values as stacked bars on the chart
-for site in age_count.index:
-    site_data = age_count.loc[site]
-    # Update x_values within the loop
-    x_values = [f"{interval}-{interval + age_interval_step - 1}" for interval in age_intervals[:-1]]
-    x_values.append(f"{age_intervals[-2] + 1}-{age_max}")  # Adjust the last interval to include the maximum age
-    for i, gender in enumerate(site_data.index):
-        if isinstance(site_data[gender], int):
-            y_values = [site_data[gender]] * len(age_intervals[:-1])
-        else:
-            y_values = site_data[gender].tolist()
-        fig_bar_ages.add_trace(go.Bar(
-            x=x_values,
-            y=y_values,
-            name=f"{site} - {gender}",
-            marker_color=gender_colors[gender],  # Use gender as a key to access color
-            legendgroup=f"{site} - {gender}",
-            offsetgroup=f"{site} - {gender}"
-        ))
-        # Calculate total for each group
-        if not y_totals:
-            y_totals = y_values.copy()
-        else:
-            for j, y_val in enumerate(y_values):
-                y_totals[j] += y_val
-
-# Update the marker colors for each bar in the stacked bar chart
-for i, trace in enumerate(fig_bar_ages.data):
-    trace.marker.color = bar_colors[i % len(bar_colors)]
-
-# Add total annotations to the chart
-for i, total in enumerate(y_totals):
-    fig_bar_ages.add_annotation(
-        x=i,
-        y=total,
-        text=str(total),
-        showarrow=False,
-        yshift=10,  # Adjust vertical position
-        font=dict(size=10)  # Adjust font size
-    )
-
-fig_bar_ages.update_layout(
+fig_bar_ages = stacked_bar_figure(sites, genders, age_counts, x_values, bar_colors, dict(
     title="Stacked Grouped Age Frequency by Site and Gender",
     xaxis_title="Age Group interval",
     yaxis_title="Frequency",
-    barmode='stack',  # Change the barmode to 'stack' for stacked bars
-    xaxis=dict(
-        tickmode='linear',
-        tickvals=list(range(len(x_values))),
-        ticktext=x_values
-    )
-)
+))
 
 # Set the desired step size for the day intervals
 day_interval_step = st.sidebar.slider('Day Interval Step', min_value=0, max_value=20, value=10)
@@ -224,74 +196,20 @@ day_intervals = list(range(day_min, day_max + 1, day_interval_step))
 if day_intervals[-1] != day_max:
     day_intervals.append(day_max)
 
-# Calculate day count by site and gender
-day_count = filtered_data.groupby(['site', 'gender'])['days_gap'].apply(lambda x: np.histogram(x, bins=day_intervals)[0]).unstack(fill_value=0)
-
-# Create the stacked bar chart for day frequency
-fig_bar_day = go.Figure()
-
-# Assign the colors for sites and genders
-site_colors = ['rgb(255, 0, 0)', 'rgb(0, 128, 0)', 'rgb(0, 0, 255)', 'rgb(255, 255, 0)', 'rgb(128, 0, 128)']  # Update site colors
-gender_colors = {'MALE': 'rgb(0, 0, 255)', 'FEMALE': 'rgb(255, 165, 0)', 'OTHER': 'rgb(255, 0, 255)'}  # Update gender colors
-bar_colors = ['rgb(255, 165, 0)', 'rgb(165, 42, 42)', 'rgb(0, 128, 128)', 'rgb(128, 0, 128)', 'rgb(0, 255, 255)', 'rgb(255, 0, 255)']  # Update bar colors
-
-
-# Initialize lists to store x and y values
-x_values = []
-y_totals = []
-
-# Add the day values as stacked bars on the chart
-for site in day_count.index:
-    site_data = day_count.loc[site]
-    # Update x_values within the loop
-    x_values = [f"{interval}-{interval + day_interval_step - 1}" for interval in day_intervals[:-1]]
-    x_values.append(f"{day_intervals[-2] + 1}-{day_max}")  # Adjust the last interval to include the maximum day
-    for i, gender in enumerate(site_data.index):
-        if isinstance(site_data[gender], int):
-            y_values = [site_data[gender]] * len(day_intervals[:-1])
-        else:
-            y_values = site_data[gender].tolist()
-        fig_bar_day.add_trace(go.Bar(
-            x=x_values,
-            y=y_values,
-            name=f"{site} - {gender}",
-            marker_color=gender_colors[gender],  # Use gender as a key to access color
-            legendgroup=f"{site} - {gender}",
-            offsetgroup=f"{site} - {gender}"
-        ))
-        # Calculate total for each group
-        if not y_totals:
-            y_totals = y_values.copy()
-        else:
-            for j, y_val in enumerate(y_values):
-                y_totals[j] += y_val
-
-# Update the marker colors for each bar in the stacked bar chart
-for i, trace in enumerate(fig_bar_day.data):
-    trace.marker.color = bar_colors[i % len(bar_colors)]
+# Counts as a (site x gender x interval) array
+sites, genders, day_counts = filtered_cube.histogram(['site', 'gender'], 'days_gap').rebin_grid(day_intervals)
 
-# Add total annotations to the chart
-for i, total in enumerate(y_totals):
-    fig_bar_day.add_annotation(
-        x=i,
-        y=total,
-        text=str(total),
-        showarrow=False,
-        yshift=10,  # Adjust vertical position
-        font=dict(size=10)  # Adjust font size
-    )
+# Interval labels; the last interval runs up to the maximum day
+x_values = [f"{interval}-{interval + day_interval_step - 1}" for interval in day_intervals[:-1]]
+x_values.append(f"{day_intervals[-2] + 1}-{day_max}")
 
-fig_bar_day.update_layout(
+# Create the stacked bar chart for day frequency, with every trace and total annotation in one go
+bar_colors = ['rgb(255, 165, 0)', 'rgb(165, 42, 42)', 'rgb(0, 128, 128)', 'rgb(128, 0, 128)', 'rgb(0, 255, 255)', 'rgb(255, 0, 255)']
+fig_bar_day = stacked_bar_figure(sites, genders, day_counts, x_values, bar_colors, dict(
     title="Stacked Grouped Day Frequency by Site and Gender",
     xaxis_title="Day Group interval",
     yaxis_title="Frequency",
-    barmode='stack',  # Change the barmode to 'stack' for stacked bars
-    xaxis=dict(
-        tickmode='linear',
-        tickvals=list(range(len(x_values))),
-        ticktext=x_values
-    )
-)
+))
 
 
 # Create the pie chart for sample type count with sample type colors
@@ -413,39 +331,14 @@ table_title = "Data for\n" + "\n".join(table_title_parts)
 # Prepare data for download
 export_df = filtered_data[selected_columns]
 
-# Prepare the Excel content
-excel_content = io.BytesIO()
-with pd.ExcelWriter(excel_content, engine='xlsxwriter') as writer:
-    workbook = writer.book
-    worksheet = workbook.add_worksheet('Sheet1')
-
-    # Merge cells for the title
-    title_format = workbook.add_format({
-        'bold': True,
-        'align': 'center',
-        'valign': 'vcenter',
-        'font_size': 10,
-        'text_wrap': True
-    })
-    worksheet.merge_range('A1:G5', table_title, title_format)
-
-    # Write the column headers
-    header_format = workbook.add_format({
-        'bold': True
-    })
-    for col_idx, header in enumerate(export_df.columns):
-        worksheet.write(5, col_idx, header, header_format)
-
-    # Write the data
-    for row_idx, row in enumerate(export_df.itertuples(), start=6):
-        for col_idx, value in enumerate(row[1:], start=0):
-            worksheet.write(row_idx, col_idx, str(value))  # Convert value to string
-
 # Display the table title
 st.write(table_title)
 
-# Display the table
-st.dataframe(export_df, width=800, height=600)
+# Display the table a page at a time; the key covers the page, data version, filters
+# and the exported columns and title, and caches both the sort orders and the workbook
+export_key = state_key('home', dataset_version(WORKBOOK, schema=HISTOLOGY), selection, ranges,
+                       selected_columns, table_title)
+paged_table(export_df, "export_table", data_key=export_key, width=800, height=600)
 
 # Compute and display the grand total
 grand_total = filtered_data.shape[0]
@@ -453,70 +346,19 @@ st.write("TOTAL:", grand_total)
 
 # Download the data with title included
 if st.button("Download Data"):
+    # The workbook is only built on request, and reused for the same data version and filters
     # Download data as Excel
     st.download_button(
         label="Download Excel",
-        data=excel_content.getvalue(),
+        data=cached_excel(export_key, export_df, table_title),
         file_name='filtered_data.xlsx',
-        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        mime=EXCEL_MIME
     )
 
-# Filter out records with zero age for statistics calculation
-age_data_nonzero = filtered_table_data[filtered_table_data['age'] != 0]['age']
-
-# Calculate statistics for the 'age' column excluding zero values
-age_count = len(age_data_nonzero)
-age_mean = round(age_data_nonzero.mean(), 2)
-age_std = round(age_data_nonzero.std(), 2)
-age_min = int(age_data_nonzero.min())
-age_q1 = int(np.percentile(age_data_nonzero, 25))
-age_median = int(np.percentile(age_data_nonzero, 50))
-age_q3 = int(np.percentile(age_data_nonzero, 75))
-age_max = int(age_data_nonzero.max())
-age_range = age_max - age_min
-age_mode = int(age_data_nonzero.mode().values[0])
-
-
-# Calculate statistics for the 'days_gap' column
-days_gap_data = filtered_table_data['days_gap']
-days_gap_count = len(days_gap_data)
-days_gap_mean = round(sum(days_gap_data) / days_gap_count, 2)
-days_gap_std = round(np.sqrt(sum((x - days_gap_mean) ** 2 for x in days_gap_data) / days_gap_count), 2)
-days_gap_min = int(days_gap_data.min())
-days_gap_q1 = int(np.percentile(days_gap_data, 25))
-days_gap_median = int(np.percentile(days_gap_data, 50))
-days_gap_q3 = int(np.percentile(days_gap_data, 75))
-days_gap_max = int(days_gap_data.max())
-days_gap_range = days_gap_max - days_gap_min
-days_gap_mode = int(days_gap_data.mode().values[0])
-
-# Create a DataFrame for age statistics excluding zero values
-age_stats_formatted = pd.DataFrame({
-    'count': [age_count],
-    'mean': [age_mean],
-    'std': [age_std],
-    'min': [age_min],
-    '25%': [age_q1],
-    '50%': [age_median],
-    '75%': [age_q3],
-    'max': [age_max],
-    'range': [age_range],
-    'mode': [age_mode]
-})
-
-# Create a DataFrame for days_gaps statistics
-days_gap_stats_formatted = pd.DataFrame({
-    'count': [days_gap_count],
-    'mean': [days_gap_mean],
-    'std': [days_gap_std],
-    'min': [days_gap_min],
-    '25%': [days_gap_q1],
-    '50%': [days_gap_median],
-    '75%': [days_gap_q3],
-    'max': [days_gap_max],
-    'range': [days_gap_range],
-    'mode': [days_gap_mode]
-})
+# Calculate statistics for the 'age' column excluding zero values, and for the
+# 'days_gap' column (population standard deviation), each in one vectorised pass
+age_stats_formatted = pd.DataFrame([rounded(describe(filtered_table_data['age'], exclude_zero=True))])
+days_gap_stats_formatted = pd.DataFrame([rounded(describe(filtered_table_data['days_gap'], ddof=0))])
 
 # Function to remove decimal points and trailing zeros from integers
 def remove_decimal_zeros(value):
@@ -0,0 +1,219 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:  # pandas < 2.2
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+
+# Upper bound on the memory an upload may take, as Arrow chunks or as the final frame; raise it per deployment
+MEMORY_LIMIT_MB = int(os.environ.get("UPLOAD_MEMORY_LIMIT_MB", 2048))
+CHUNK_ROWS = 100_000
+
+# Parsed datasets by id, shared by every session, most recently used last
+MAX_CACHED_DATASETS = 4
+_lock = threading.Lock()
+_dataset_locks = {}
+_datasets = OrderedDict()
+
+
+class ColumnarBuilder:
+    """Appends DataFrame chunks to a list of compact Arrow tables.
+
+    Date columns are parsed once per chunk, with one format inferred from the
+    first chunk, and text columns are dictionary-encoded as they arrive, so
+    the parsed upload never exists as one large object-dtype frame. Which
+    text columns stay categorical is decided at the end from their
+    cardinality over every chunk. The memory limit is checked against the
+    larger of the Arrow chunks and the estimated size of the final frame.
+    """
+
+    def __init__(self, date_columns=(), memory_limit_mb=MEMORY_LIMIT_MB):
+        self.date_columns = list(date_columns)
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+        self.tables = []
+        self.date_formats = {}
+        self.text_columns = {}
+        self.nbytes = 0
+        self.pandas_nbytes = 0
+        self.rows = 0
+
+    def _parse_dates(self, chunk):
+        for col in self.date_columns:
+            if col not in chunk.columns:
+                continue
+            if col not in self.date_formats:
+                self.date_formats[col] = self._date_format(chunk[col].dropna())
+            # Without a format that fits every row, let each value be parsed on its own
+            chunk[col] = pd.to_datetime(chunk[col], format=self.date_formats[col] or "mixed")
+
+    @staticmethod
+    def _date_format(values):
+        # The month-first or day-first reading of the first value that parses
+        # the whole first chunk, so every later chunk is read the same way
+        if not len(values) or not isinstance(values.iloc[0], str):
+            return None
+        for dayfirst in (False, True):
+            candidate = guess_datetime_format(values.iloc[0], dayfirst=dayfirst)
+            if candidate and pd.to_datetime(values, format=candidate, errors="coerce").notna().all():
+                return candidate
+        return None
+
+    def _pandas_size(self, chunk, table):
+        # What this chunk will cost in the final frame: text columns that look
+        # repetitive so far become categorical codes, the rest Python strings
+        size = 0
+        for i, field in enumerate(table.schema):
+            if field.name in self.text_columns:
+                distinct, rows = self.text_columns[field.name]
+                if distinct * 2 <= rows:
+                    size += sum(c.indices.nbytes for c in table.column(i).chunks)
+                    continue
+                size += int(chunk[field.name].memory_usage(index=False, deep=True))
+            else:
+                size += table.column(i).nbytes
+        return size
+
+    def append(self, chunk):
+        self._parse_dates(chunk)
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        for i, field in enumerate(table.schema):
+            if pa.types.is_string(field.type) or field.name in self.text_columns:
+                column = table.column(i).cast(pa.string()).dictionary_encode()
+                table = table.set_column(i, field.name, column)
+                # Distinct counts summed over chunks: an upper bound on the true cardinality
+                distinct, rows = self.text_columns.get(field.name, (0, 0))
+                self.text_columns[field.name] = (distinct + sum(len(c.dictionary) for c in column.chunks),
+                                                 rows + len(table))
+        self.nbytes += table.nbytes
+        self.pandas_nbytes += self._pandas_size(chunk, table)
+        if max(self.nbytes, self.pandas_nbytes) > self.memory_limit:
+            raise MemoryError(
+                f"Upload exceeds the {self.memory_limit // (1024 * 1024)} MB ingestion limit "
+                f"after {self.rows + len(chunk):,} rows"
+            )
+        self.tables.append(table)
+        self.rows += len(chunk)
+
+    def _aligned(self, table):
+        # A text column can arrive in an early chunk as all-missing floats;
+        # give it the same dictionary type as in the other chunks
+        for i, field in enumerate(table.schema):
+            if field.name in self.text_columns and not pa.types.is_dictionary(field.type):
+                column = table.column(i).cast(pa.string()).dictionary_encode()
+                table = table.set_column(i, field.name, column)
+        return table
+
+    def to_pandas(self):
+        if not self.tables:
+            return pd.DataFrame()
+        tables = [self._aligned(table) for table in self.tables]
+        self.tables = []
+        table = pa.concat_tables(tables, promote_options="permissive").unify_dictionaries()
+        del tables
+        for i, field in enumerate(table.schema):
+            if field.name not in self.text_columns:
+                continue
+            column = table.column(i)
+            distinct = len(column.chunk(0).dictionary) if column.num_chunks else 0
+            # Mostly unique text is cheaper as plain strings than as categories
+            if distinct * 2 > len(table):
+                table = table.set_column(i, field.name, column.cast(pa.string()))
+        # self_destruct frees each Arrow column once converted, so the upload is
+        # not held twice; split_blocks avoids consolidating the columns into a copy
+        return table.to_pandas(self_destruct=True, split_blocks=True)
+
+
+def _excel_chunks(source, chunk_rows):
+    from openpyxl import load_workbook
+
+    # read_only streams rows from the sheet XML instead of building the whole DOM
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(col) for col in header]
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunk_rows:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def _source_size(source):
+    size = getattr(source, "size", None)
+    if size is None and hasattr(source, "getbuffer"):
+        size = source.getbuffer().nbytes
+    elif size is None and hasattr(source, "fileno"):
+        size = os.fstat(source.fileno()).st_size
+    return size
+
+
+def ingest(source, filename=None, date_columns=(), chunk_rows=CHUNK_ROWS,
+           memory_limit_mb=MEMORY_LIMIT_MB, encoding="ISO-8859-1", progress=None):
+    """Read a csv/txt/xlsx upload chunk by chunk into a compact DataFrame.
+
+    source is a path or a file-like object such as a Streamlit UploadedFile.
+    progress, if given, is called with the fraction of the input consumed.
+    Legacy .xls files have no streaming reader and are read in one go.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as handle:
+            return ingest(handle, filename or str(source), date_columns, chunk_rows,
+                          memory_limit_mb, encoding, progress)
+
+    filename = filename or getattr(source, "name", None) or ""
+    extension = os.path.splitext(filename)[1].lower()
+    builder = ColumnarBuilder(date_columns, memory_limit_mb)
+    size = _source_size(source)
+
+    if extension == ".xls":
+        builder.append(pd.read_excel(source))
+    else:
+        if extension == ".xlsx":
+            chunks = _excel_chunks(source, chunk_rows)
+        else:
+            chunks = pd.read_csv(source, encoding=encoding, chunksize=chunk_rows)
+        for chunk in chunks:
+            builder.append(chunk)
+            if progress is not None and size and hasattr(source, "tell"):
+                progress(min(source.tell() / size, 1.0))
+    if progress is not None:
+        progress(1.0)
+    return builder.to_pandas()
+
+
+def cached_dataset(data_id, build):
+    """build() memoised by data_id for every session in the process.
+
+    data_id must change whenever the underlying file does. Concurrent
+    sessions asking for the same id wait for one build instead of each
+    running their own; a build that raises is not cached.
+    """
+    with _lock:
+        if data_id in _datasets:
+            _datasets.move_to_end(data_id)
+            return _datasets[data_id]
+        dataset_lock = _dataset_locks.setdefault(data_id, threading.Lock())
+    with dataset_lock:
+        with _lock:
+            if data_id in _datasets:
+                return _datasets[data_id]
+        dataset = build()
+        with _lock:
+            _datasets[data_id] = dataset
+            while len(_datasets) > MAX_CACHED_DATASETS:
+                evicted, _ = _datasets.popitem(last=False)
+                _dataset_locks.pop(evicted, None)
+        return dataset
@@ -3,7 +3,12 @@ import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
 import numpy as np
-import io
+from aggregates import CountCube
+from charts import stacked_bar_figure
+from data_store import dataset_version, load_derived, load_workbook
+from export import EXCEL_MIME, cached_excel, state_key
+from filters import BitmapIndex
+from schema import HISTOLOGY
 
 st.set_page_config(page_title="ICI", page_icon="data/ici.png", layout="wide")
 
@@ -20,16 +25,23 @@ st.header("🔬 Histology Data Analysis")
 with open('style.css') as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 # Load the Excel file
-data = pd.read_excel('histof.xlsx')
+WORKBOOK = 'histof.xlsx'
+FILTER_COLUMNS = ['site', 'gender', 'age', 'sample_type', 'findings', 'days_gap']
+data = load_workbook(WORKBOOK, schema=HISTOLOGY)
 
 
+# Bitmap index over the filter columns, built once per version of the workbook
+filter_index = load_derived('filter_index', lambda frame: BitmapIndex(frame, FILTER_COLUMNS), WORKBOOK, schema=HISTOLOGY)
+# Counts over every observed combination of the filter columns, for the charts
+count_cube = load_derived('count_cube', lambda frame: CountCube(frame, FILTER_COLUMNS), WORKBOOK, schema=HISTOLOGY)
+
 # Get unique values from the 'site', 'gender', 'age', 'sample_type', 'findings' and 'days_gap' columns
-site_options = ['All'] + list(data['site'].unique())
-gender_options = ['All'] + list(data['gender'].unique())
-age_options = ['All'] + list(data['age'].unique())
-sample_type_options = ['All'] + list(data['sample_type'].unique())
-findings_options = ['All'] + list(data['findings'].unique())
-days_gap_options = ['All'] + list(data['days_gap'].unique())
+site_options = ['All'] + filter_index.options('site')
+gender_options = ['All'] + filter_index.options('gender')
+age_options = ['All'] + filter_index.options('age')
+sample_type_options = ['All'] + filter_index.options('sample_type')
+findings_options = ['All'] + filter_index.options('findings')
+days_gap_options = ['All'] + filter_index.options('days_gap')
 
 # Add a sidebar for site, gender, age, sample type, and findings selection
 selected_sites = st.sidebar.multiselect("Select Site", site_options, default=['All'])
@@ -37,12 +49,18 @@ selected_gender = st.sidebar.multiselect("Select Gender", gender_options, defaul
 selected_sample_type = st.sidebar.multiselect("Select Sample Type", sample_type_options, default=['All'], key="sample_type_select")
 selected_findings = st.sidebar.multiselect("Select Findings", findings_options, default=['All'], key="findings_select")
 
-# Filter the data based on the selected sites, gender, age, sample type, and findings days gaps
-if 'All' in selected_sites:
-    filtered_data = data
-else:
-    filtered_data = data[data['site'].isin(selected_sites)]
-
+# Filter the data based on the selected sites, gender, sample type and findings.
+# 'All' leaves a column unconstrained; the rows are taken once from the combined bitmap
+# and the charts are served from the matching slice of the count cube.
+selection = {
+    'site': None if 'All' in selected_sites else selected_sites,
+    'gender': None if 'All' in selected_gender else selected_gender,
+    'sample_type': None if 'All' in selected_sample_type else selected_sample_type,
+    'findings': None if 'All' in selected_findings else selected_findings,
+}
+filtered_data = filter_index.select(data, selection)
+
+# Expand 'All' for the table title
 if 'All' in selected_gender:
     selected_gender = gender_options[1:]
 
@@ -53,17 +71,14 @@ if 'All' in selected_sample_type:
 if 'All' in selected_findings:
     selected_findings = findings_options[1:]
 
-
-filtered_data = filtered_data[filtered_data['gender'].isin(selected_gender)]
-filtered_data = filtered_data[filtered_data['sample_type'].isin(selected_sample_type)]
-filtered_data = filtered_data[filtered_data['findings'].isin(selected_findings)]
 print(filtered_data['age'].dtypes)
-site_count = filtered_data['site'].value_counts()
-gender_count = filtered_data['gender'].value_counts()
-age_count = filtered_data.groupby(['site', 'gender', 'age']).size().unstack(fill_value=0)
-sample_type_count = filtered_data['sample_type'].value_counts()
-findings_count = filtered_data['findings'].value_counts()
-days_gap_count = filtered_data.groupby(['site', 'gender', 'days_gap']).size().unstack(fill_value=0)
+filtered_cube = count_cube.slice(selection)
+site_count = filtered_cube.value_counts('site')
+gender_count = filtered_cube.value_counts('gender')
+age_count = filtered_cube.rollup(['site', 'gender', 'age']).unstack(fill_value=0)
+sample_type_count = filtered_cube.value_counts('sample_type')
+findings_count = filtered_cube.value_counts('findings')
+days_gap_count = filtered_cube.rollup(['site', 'gender', 'days_gap']).unstack(fill_value=0)
 
 #for initialization
 # Get the columns chosen in the charts
@@ -131,74 +146,20 @@ day_intervals = list(range(day_min, day_max + 1, day_interval_step))
 if day_intervals[-1] != day_max:
     day_intervals.append(day_max)
 
-# Calculate day count by site and gender
-day_count = filtered_data.groupby(['site', 'gender'])['days_gap'].apply(lambda x: np.histogram(x, bins=day_intervals)[0]).unstack(fill_value=0)
-
-# Create the stacked bar chart for day frequency
-fig_bar_day = go.Figure()
-
-# Assign the colors for sites and genders
-site_colors = ['rgb(255, 0, 0)', 'rgb(0, 128, 0)', 'rgb(0, 0, 255)', 'rgb(255, 255, 0)', 'rgb(128, 0, 128)']  # Update site colors
-gender_colors = {'MALE': 'rgb(0, 0, 255)', 'FEMALE': 'rgb(255, 165, 0)', 'OTHER': 'rgb(255, 0, 255)'}  # Update gender colors
-bar_colors = ['rgb(255, 165, 0)', 'rgb(165, 42, 42)', 'rgb(0, 128, 128)', 'rgb(128, 0, 128)', 'rgb(0, 255, 255)', 'rgb(255, 0, 255)']  # Update bar colors
-
-
-# Initialize lists to store x and y values
-x_values = []
-y_totals = []
-
-# Add the day values as stacked bars on the chart
-for site in day_count.index:
-    site_data = day_count.loc[site]
-    # Update x_values within the loop
-    x_values = [f"{interval}-{interval + day_interval_step - 1}" for interval in day_intervals[:-1]]
-    x_values.append(f"{day_intervals[-2] + 1}-{day_max}")  # Adjust the last interval to include the maximum day
-    for i, gender in enumerate(site_data.index):
-        if isinstance(site_data[gender], int):
-            y_values = [site_data[gender]] * len(day_intervals[:-1])
-        else:
-            y_values = site_data[gender].tolist()
-        fig_bar_day.add_trace(go.Bar(
-            x=x_values,
-            y=y_values,
-            name=f"{site} - {gender}",
-            marker_color=gender_colors[gender],  # Use gender as a key to access color
-            legendgroup=f"{site} - {gender}",
-            offsetgroup=f"{site} - {gender}"
-        ))
-        # Calculate total for each group
-        if not y_totals:
-            y_totals = y_values.copy()
-        else:
-            for j, y_val in enumerate(y_values):
-                y_totals[j] += y_val
-
-# Update the marker colors for each bar in the stacked bar chart
-for i, trace in enumerate(fig_bar_day.data):
-    trace.marker.color = bar_colors[i % len(bar_colors)]
-
-# Add total annotations to the chart
-for i, total in enumerate(y_totals):
-    fig_bar_day.add_annotation(
-        x=i,
-        y=total,
-        text=str(total),
-        showarrow=False,
-        yshift=10,  # Adjust vertical position
-        font=dict(size=10)  # Adjust font size
-    )
+# Counts as a (site x gender x interval) array
+sites, genders, day_counts = filtered_cube.histogram(['site', 'gender'], 'days_gap').rebin_grid(day_intervals)
 
-fig_bar_day.update_layout(
+# Interval labels; the last interval runs up to the maximum day
+x_values = [f"{interval}-{interval + day_interval_step - 1}" for interval in day_intervals[:-1]]
+x_values.append(f"{day_intervals[-2] + 1}-{day_max}")
+
+# Create the stacked bar chart for day frequency, with every trace and total annotation in one go
+bar_colors = ['rgb(255, 165, 0)', 'rgb(165, 42, 42)', 'rgb(0, 128, 128)', 'rgb(128, 0, 128)', 'rgb(0, 255, 255)', 'rgb(255, 0, 255)']
+fig_bar_day = stacked_bar_figure(sites, genders, day_counts, x_values, bar_colors, dict(
     title="Stacked Grouped Day Frequency by Site and Gender",
     xaxis_title="Day Group interval",
     yaxis_title="Frequency",
-    barmode='stack',  # Change the barmode to 'stack' for stacked bars
-    xaxis=dict(
-        tickmode='linear',
-        tickvals=list(range(len(x_values))),
-        ticktext=x_values
-    )
-)
+))
 
 # Define initial width and height for the charts
 initial_chart_width = 100
@@ -238,7 +199,7 @@ if show_bar_day:
 
 
 # Calculate the histogram of days_gap values
-hist, _ = np.histogram(filtered_data['days_gap'], bins=day_intervals)
+hist = filtered_cube.histogram(['site', 'gender'], 'days_gap').rebin(day_intervals).sum()
 
 # Find the index of the interval with the highest frequency
 modal_interval_index = np.argmax(hist)
@@ -309,43 +270,18 @@ table_title = "Data for\n" + "\n".join(table_title_parts)
 # Prepare data for download
 export_df = filtered_data[selected_columns]
 
-# Prepare the Excel contents
-excel_content = io.BytesIO()
-with pd.ExcelWriter(excel_content, engine='xlsxwriter') as writer:
-    workbook = writer.book
-    worksheet = workbook.add_worksheet('Sheet1')
-
-    # Merge cells for the title
-    title_format = workbook.add_format({
-        'bold': True,
-        'align': 'center',
-        'valign': 'vcenter',
-        'font_size': 10,
-        'text_wrap': True
-    })
-    worksheet.merge_range('A1:G5', table_title, title_format)
-
-    # Write the column headers
-    header_format = workbook.add_format({
-        'bold': True
-    })
-    for col_idx, header in enumerate(export_df.columns):
-        worksheet.write(5, col_idx, header, header_format)
-
-    # Write the data
-    for row_idx, row in enumerate(export_df.itertuples(), start=6):
-        for col_idx, value in enumerate(row[1:], start=0):
-            worksheet.write(row_idx, col_idx, str(value))  # Convert value to string
-
 
 # Download the data with title included
 if st.button("Download Data"):
+    # The workbook is only built on request, and reused for the same data version and filters
+    export_key = state_key('pie_charts', dataset_version(WORKBOOK, schema=HISTOLOGY), selection,
+                           selected_columns, table_title)
     # Download data as Excel
     st.download_button(
         label="Download Excel",
-        data=excel_content.getvalue(),
+        data=cached_excel(export_key, export_df, table_title),
         file_name='filtered_data.xlsx',
-        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        mime=EXCEL_MIME
     )
 
 
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+# Declared column types per dataset. "category" columns are dictionary-encoded;
+# integer columns are downcast, switching to the nullable variant of the same
+# width when the column has missing values so gaps stay typed instead of
+# turning the column into floats or strings. The declared width is a target,
+# not a promise: values it can't hold exactly are kept in a wider type.
+HISTOLOGY = {
+    "name": "histology",
+    "columns": {
+        "site": "category",
+        "gender": "category",
+        "sample_type": "category",
+        "findings": "category",
+        "age": "uint8",
+        "days_gap": "int16",
+    },
+}
+
+COLPOSCOPY = {
+    "name": "colposcopy",
+    "columns": {
+        "program": "category",
+        "location": "category",
+        "Via_Results": "category",
+        "name": "category",
+        "Colposcopic_impression": "category",
+        "HIV_STATUS": "category",
+        "hpvdna": "category",
+        "hpv16": "category",
+        "hpv18": "category",
+        "age": "uint8",
+        "biopsyfindings": "float32",
+        "papsmear": "float32",
+    },
+    # The colposcopy filters offer missing results as an explicit "None" choice
+    "category_missing": "None",
+}
+
+FOOD_SALES = {
+    "name": "food_sales",
+    "columns": {
+        "Region": "category",
+        "City": "category",
+        "Category": "category",
+        "Product": "category",
+        "Quantity": "int32",
+    },
+}
+
+
+def _nullable(dtype):
+    # uint8 -> UInt8, int16 -> Int16, ...
+    return "UInt" + dtype[4:] if dtype.startswith("uint") else "Int" + dtype[3:]
+
+
+def _integer_dtype(values, dtype):
+    # The declared integer type if every value fits it, else the narrowest
+    # integer type that does, or float64 when some values are fractional
+    present = values.dropna()
+    if not len(present):
+        return dtype
+    if (present != np.floor(present)).any():
+        return "float64"
+    low, high = present.min(), present.max()
+    wider = [f"{kind}{bits}" for bits in (8, 16, 32, 64) for kind in ("uint", "int")
+             if np.dtype(f"{kind}{bits}").itemsize > np.dtype(dtype).itemsize]
+    for candidate in [dtype] + wider:
+        info = np.iinfo(candidate)
+        if info.min <= low and high <= info.max:
+            return candidate
+    return "float64"
+
+
+def apply_schema(frame, schema):
+    """Cast the columns named in a schema; columns it doesn't mention are left alone."""
+    frame = frame.copy(deep=False)
+    missing_label = schema.get("category_missing")
+    for col, dtype in schema["columns"].items():
+        if col not in frame.columns:
+            continue
+        values = frame[col]
+        if dtype == "category":
+            if missing_label is not None and values.isna().any():
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    if missing_label not in values.cat.categories:
+                        values = values.cat.add_categories([missing_label])
+                values = values.fillna(missing_label)
+            frame[col] = values.astype("category")
+        elif np.issubdtype(np.dtype(dtype), np.integer):
+            values = pd.to_numeric(values)
+            fitted = _integer_dtype(values, dtype)
+            if fitted != "float64" and values.isna().any():
+                fitted = _nullable(fitted)
+            frame[col] = values.astype(fitted)
+        else:
+            frame[col] = values.astype(dtype)
+    return frame
+
+
+def observed_counts(series):
+    """value_counts() that leaves out categories with no rows, as object columns do."""
+    counts = series.value_counts()
+    return counts[counts > 0]
+
+
+def memory_report(before, after):
+    """Per-column deep memory usage of a frame before and after apply_schema."""
+    report = pd.DataFrame({
+        "dtype_before": before.dtypes.astype(str),
+        "bytes_before": before.memory_usage(index=False, deep=True),
+        "dtype_after": after.dtypes.astype(str),
+        "bytes_after": after.memory_usage(index=False, deep=True),
+    })
+    report.loc["TOTAL"] = ["", report["bytes_before"].sum(), "", report["bytes_after"].sum()]
+    report["ratio"] = (report["bytes_before"] / report["bytes_after"]).round(1)
+    return report
+
+
+if __name__ == "__main__":
+    from data_store import WORKBOOKS
+
+    for path, sheet_name, schema in WORKBOOKS:
+        raw = pd.read_excel(path, sheet_name=sheet_name)
+        print(f"\n{path}")
+        print(memory_report(raw, apply_schema(raw, schema)).to_string())
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+STAT_NAMES = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max', 'range', 'mode']
+
+
+def _percentile(sorted_values, starts, counts, q):
+    # np.percentile's default linear interpolation, for every segment at once
+    position = q * (counts - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    fraction = position - lower
+    low_values = sorted_values[starts + lower]
+    return low_values + fraction * (sorted_values[starts + upper] - low_values)
+
+
+def _describe_segments(values, codes, n_groups, ddof):
+    # One lexsort puts every group's values next to each other in ascending
+    # order; every statistic is then read off the segments with vectorised ops
+    order = np.lexsort((values, codes))
+    values, codes = values[order], codes[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    present = counts > 0
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    stats = {name: np.full(n_groups, np.nan) for name in STAT_NAMES}
+    stats['count'] = counts.astype(float)
+    if not present.any():
+        return stats
+
+    sums = np.bincount(codes, weights=values, minlength=n_groups)
+    mean = np.divide(sums, counts, out=np.full(n_groups, np.nan), where=present)
+    squares = np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=n_groups)
+    dof = counts - ddof
+    stats['mean'] = mean
+    stats['std'] = np.sqrt(np.divide(squares, dof, out=np.full(n_groups, np.nan), where=dof > 0))
+
+    seg_starts, seg_counts = starts[present], counts[present]
+    stats['min'][present] = values[seg_starts]
+    stats['max'][present] = values[seg_starts + seg_counts - 1]
+    stats['range'] = stats['max'] - stats['min']
+    for name, q in (('25%', 0.25), ('50%', 0.5), ('75%', 0.75)):
+        stats[name][present] = _percentile(values, seg_starts, seg_counts, q)
+
+    # Mode: the longest run of equal values per group, smallest value on ties
+    run_starts = np.flatnonzero(np.concatenate([[True], (values[1:] != values[:-1]) | (codes[1:] != codes[:-1])]))
+    run_lengths = np.diff(np.append(run_starts, len(values)))
+    run_codes = codes[run_starts]
+    best = np.lexsort((np.arange(len(run_starts)), -run_lengths, run_codes))
+    first = best[np.unique(run_codes[best], return_index=True)[1]]
+    stats['mode'][run_codes[first]] = values[run_starts[first]]
+    return stats
+
+
+def _numeric(series, exclude_zero):
+    values = series.to_numpy(dtype=float, na_value=np.nan)
+    keep = ~np.isnan(values)
+    if exclude_zero:
+        keep &= values != 0
+    return values, keep
+
+
+def describe(series, exclude_zero=False, ddof=1):
+    """count, mean, std, min, quartiles, max, range and mode of a numeric column.
+
+    Missing values are skipped; exclude_zero also skips zeros, as the age
+    panels do. ddof=0 gives the population standard deviation.
+    """
+    values, keep = _numeric(series, exclude_zero)
+    values = values[keep]
+    stats = _describe_segments(values, np.zeros(len(values), dtype=np.int64), 1, ddof)
+    return {name: stats[name][0] for name in STAT_NAMES}
+
+
+def describe_groups(frame, column, by, exclude_zero=False, ddof=1):
+    """describe() for every group of `by` in one pass; returns one row per group."""
+    values, keep = _numeric(frame[column], exclude_zero)
+    codes, groups = pd.factorize(frame[by], sort=True)
+    keep &= codes >= 0
+    stats = _describe_segments(values[keep], codes[keep], len(groups), ddof)
+    result = pd.DataFrame(stats, index=pd.Index(groups, name=by))
+    result['count'] = result['count'].astype(int)
+    return result
+
+
+def rounded(stats):
+    """The rounding the stats panels display: two decimals for mean and std, whole numbers elsewhere."""
+    formatted = {}
+    for name, value in stats.items():
+        if pd.isna(value):
+            formatted[name] = value
+        elif name in ('mean', 'std'):
+            formatted[name] = round(float(value), 2)
+        else:
+            formatted[name] = int(value)
+    return formatted
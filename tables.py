@@ -0,0 +1,81 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import streamlit as st
+
+PAGE_SIZES = (25, 50, 100, 250)
+
+# Row orders by (data key, column, ascending), most recently used last
+MAX_CACHED_ORDERS = 32
+_lock = threading.Lock()
+_orders = OrderedDict()
+
+
+def sort_order(data_key, frame, column, ascending=True):
+    """Row positions of frame sorted by column, memoised by data_key.
+
+    data_key must change whenever the rows of frame do, e.g. a state_key()
+    of the dataset version and filters; with None nothing is cached. The
+    sort is stable and puts missing values last, like
+    frame.sort_values(column, kind='stable').
+    """
+    key = (data_key, column, ascending)
+    with _lock:
+        if key in _orders:
+            _orders.move_to_end(key)
+            return _orders[key]
+    values = frame[column].reset_index(drop=True)
+    order = values.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+    if data_key is None:
+        return order
+    with _lock:
+        _orders[key] = order
+        while len(_orders) > MAX_CACHED_ORDERS:
+            _orders.popitem(last=False)
+    return order
+
+
+def _gradient(page, frame, cmap):
+    # Colours each numeric column against its range over the whole table, so a
+    # page is shaded the way the full table styled with background_gradient would be
+    styler = page.style
+    for column in page.select_dtypes('number').columns:
+        low, high = frame[column].min(), frame[column].max()
+        if low == low:
+            styler = styler.background_gradient(cmap=cmap, subset=[column], vmin=low, vmax=high)
+    return styler
+
+
+def paged_table(frame, key, data_key=None, gradient=None, page_size=50, sortable=True, **dataframe_kwargs):
+    """Show frame one page at a time; only the visible rows go to the browser.
+
+    The rows stay on the server: sorting reads a cached argsort (pass data_key
+    to share it across reruns, see sort_order) and a gradient cmap is applied
+    to the page alone. page_size is the initial choice from PAGE_SIZES and key
+    namespaces the paging widgets; any remaining arguments go to st.dataframe.
+    """
+    controls = st.columns(3) if sortable else st.columns(2)
+    size = controls[-1].selectbox("Rows per page", PAGE_SIZES, index=PAGE_SIZES.index(page_size),
+                                  key=f"{key}_page_size")
+    n_pages = max(1, math.ceil(len(frame) / size))
+    # A narrower selection can leave the remembered page past the end
+    if st.session_state.get(f"{key}_page", 1) > n_pages:
+        st.session_state[f"{key}_page"] = n_pages
+    page = controls[-2].number_input(f"Page (of {n_pages:,})", min_value=1, max_value=n_pages, step=1,
+                                     key=f"{key}_page")
+
+    positions = np.arange((page - 1) * size, min(page * size, len(frame)))
+    if sortable:
+        column = controls[0].selectbox("Sort by", [None] + list(frame.columns), key=f"{key}_sort",
+                                       format_func=lambda col: "(original order)" if col is None else str(col))
+        if column is not None:
+            descending = controls[0].toggle("Descending", key=f"{key}_descending")
+            data_key = None if data_key is None else (key, data_key)
+            positions = sort_order(data_key, frame, column, not descending)[positions]
+
+    rows = frame.take(positions)
+    st.dataframe(_gradient(rows, frame, gradient) if gradient else rows, **dataframe_kwargs)
+    first = (page - 1) * size
+    st.caption(f"Rows {first + 1:,}-{first + len(rows):,} of {len(frame):,}" if len(rows) else "No rows")
@@ -0,0 +1,33 @@
+"""Synthetic frames shaped like the dashboards' data, with missing values mixed in."""
+import numpy as np
+import pandas as pd
+
+SITES = ['ABCCP', 'Lancet', 'KNH']
+GENDERS = ['F', 'M']
+
+
+def records(n_rows=500, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        'site': rng.choice(SITES, n_rows),
+        'gender': rng.choice(GENDERS, n_rows).astype(object),
+        'age': rng.integers(0, 100, n_rows).astype(float),
+        'days_gap': rng.integers(0, 280, n_rows).astype(float),
+    })
+    frame.loc[rng.random(n_rows) < 0.1, 'gender'] = np.nan
+    frame.loc[rng.random(n_rows) < 0.1, 'age'] = np.nan
+    return frame
+
+
+def sales(n_rows=500, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2021-01-01') + pd.to_timedelta(rng.integers(0, 730, n_rows), unit='D')
+    frame = pd.DataFrame({
+        'Order Date': dates,
+        'Region': rng.choice(['East', 'West', 'Central'], n_rows),
+        'City': rng.choice(['Boston', 'Denver', 'Austin', 'Seattle'], n_rows),
+        'Sales': rng.random(n_rows) * 100,
+    })
+    frame.loc[rng.random(n_rows) < 0.05, 'Order Date'] = pd.NaT
+    frame['State'] = frame['City'].map({'Boston': 'MA', 'Denver': 'CO', 'Austin': 'TX', 'Seattle': 'WA'})
+    return frame
@@ -0,0 +1,140 @@
+"""Cube, histogram, KPI and rollup answers against the pandas and numpy computations they replace."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import CountCube, KpiEngine, Rollup, grouped_sums
+from filters import DateIndex
+from frames import records, sales
+
+DIMENSIONS = ['site', 'gender', 'age', 'days_gap']
+
+
+def by_index(series):
+    # value_counts orders ties arbitrarily; compare the counts per value
+    return series.sort_index()
+
+
+def test_value_counts_and_rollup_match_pandas():
+    frame = records()
+    cube = CountCube(frame, DIMENSIONS)
+    for dim in ('site', 'gender', 'age'):
+        expected = frame[dim].value_counts()
+        result = cube.value_counts(dim)
+        assert result.is_monotonic_decreasing
+        pd.testing.assert_series_equal(by_index(result), by_index(expected), check_names=False)
+    expected = frame.groupby(['site', 'gender'], observed=True).size()
+    pd.testing.assert_series_equal(cube.rollup(['site', 'gender']), expected, check_names=False)
+    assert cube.total == len(frame)
+
+
+@pytest.mark.parametrize('selection, ranges', [
+    ({'site': ['ABCCP'], 'gender': None}, {}),
+    ({'site': None, 'gender': ['F', 'M']}, {'age': (20, 60)}),
+    ({'site': ['KNH']}, {'age': (97, 97)}),
+    ({'site': []}, {}),
+])
+def test_slice_matches_filtered_rows(selection, ranges):
+    frame = records()
+    rows = frame
+    for dim, values in selection.items():
+        if values is not None:
+            rows = rows[rows[dim].isin(values)]
+    for dim, (low, high) in ranges.items():
+        rows = rows[rows[dim].between(low, high)]
+    cube = CountCube(frame, DIMENSIONS).slice(selection, ranges)
+    assert cube.total == len(rows)
+    pd.testing.assert_series_equal(by_index(cube.value_counts('site')), by_index(rows['site'].value_counts()),
+                                   check_names=False)
+
+
+@pytest.mark.parametrize('edges', [[0, 10, 20, 50, 102], [0, 25, 50, 75, 100], [5, 6, 7], [-10, 0, 300]])
+def test_rebin_matches_np_histogram(edges):
+    frame = records()
+    histogram = CountCube(frame, DIMENSIONS).histogram(['site', 'gender'], 'age')
+    binned = histogram.rebin(edges)
+    groups = frame.dropna(subset=['age']).groupby(['site', 'gender'], observed=True)['age']
+    assert list(binned.index) == list(groups.size().index)
+    for key, ages in groups:
+        np.testing.assert_array_equal(binned[key], np.histogram(ages, bins=edges)[0])
+
+    rows, columns, grid = histogram.rebin_grid(edges)
+    layout = pd.Series(0, index=binned.index).unstack()
+    assert list(rows) == list(layout.index)
+    assert list(columns) == list(layout.columns)
+    for i, row in enumerate(rows):
+        for j, column in enumerate(columns):
+            expected = binned[(row, column)] if (row, column) in binned.index else np.zeros(len(edges) - 1)
+            np.testing.assert_array_equal(grid[i, j], expected)
+
+
+def test_rebin_grid_of_empty_slice():
+    cube = CountCube(records(), DIMENSIONS).slice({}, {'age': (97, 97), 'days_gap': (0, 0)})
+    assert cube.total == 0
+    rows, columns, grid = cube.histogram(['site', 'gender'], 'age').rebin_grid([0, 50, 102])
+    assert len(rows) == len(columns) == 0
+    assert grid.shape == (0, 0, 2)
+    assert len(cube.histogram(['site', 'gender'], 'age').rebin([0, 50, 102])) == 0
+
+
+@pytest.mark.parametrize('selection, window', [
+    ({'Region': None, 'City': None}, (0, None)),
+    ({'Region': ['East'], 'City': ['Boston', 'Denver']}, (40, 300)),
+    ({'City': ['Seattle']}, (100, 101)),
+    ({'City': []}, (0, None)),
+])
+def test_kpis_match_pandas(selection, window):
+    frame = sales()
+    frame.loc[frame.index[::17], 'Sales'] = np.nan
+    index = DateIndex(frame, 'Order Date')
+    engine = KpiEngine(index.frame, ['Region', 'City'], 'Sales')
+    rows = index.frame.iloc[slice(*window)]
+    for dim, values in selection.items():
+        if values is not None:
+            rows = rows[rows[dim].isin(values)]
+    kpis = engine.summary(selection, *window)
+    assert kpis['count'] == len(rows)
+    assert kpis['sum'] == pytest.approx(rows['Sales'].sum())
+    for name in ('median', 'max', 'min'):
+        expected = getattr(rows['Sales'], name)()
+        assert np.isnan(kpis[name]) if np.isnan(expected) else kpis[name] == pytest.approx(expected)
+
+
+def test_kpi_sums_match_groupby():
+    frame = sales()
+    engine = KpiEngine(frame, ['Region'], 'Sales')
+    for region, total in frame.groupby('Region')['Sales'].sum().items():
+        assert engine.summary({'Region': [region]})['sum'] == pytest.approx(total)
+
+
+def test_grouped_sums_match_groupby():
+    frame = sales()
+    expected = frame.groupby('Region', as_index=False)['Sales'].sum()
+    pd.testing.assert_frame_equal(grouped_sums(frame, 'Region', 'Sales', sort=True), expected)
+    assert list(grouped_sums(frame, 'Region', 'Sales')['Region']) == list(frame['Region'].unique())
+
+
+@pytest.mark.parametrize('freq', ['D', 'W', 'M', 'Q'])
+@pytest.mark.parametrize('start, end', [(None, None), ('2021-02-10', '2022-11-20'), ('2021-05-03', '2021-05-20')])
+def test_timeline_matches_resampled_rows(freq, start, end):
+    frame = sales()
+    rollup = Rollup(frame, 'Order Date', ['Region', 'City'], 'Sales')
+    selection = {'Region': ['East', 'West'], 'City': None}
+    rows = frame[frame['Region'].isin(selection['Region'])].dropna(subset=['Order Date'])
+    if start is not None:
+        rows = rows[rows['Order Date'].between(start, end)]
+    expected = rows.groupby(rows['Order Date'].dt.to_period(freq))['Sales'].sum()
+    pd.testing.assert_series_equal(rollup.timeline(selection, start, end, freq), expected, check_names=False)
+
+
+@pytest.mark.parametrize('monthly', [False, True])
+def test_mean_table_matches_pivot_table(monthly):
+    frame = sales()
+    rollup = Rollup(frame, 'Order Date', ['Region', 'City'], 'Sales')
+    start, end = pd.Timestamp('2021-02-10'), pd.Timestamp('2022-06-30')
+    rows = frame[frame['Order Date'].between(start, end)]
+    month = rows['Order Date'].dt.month_name().rename('month')
+    expected = rows.assign(month=month).pivot_table(values='Sales', index='City', columns='month', aggfunc='mean')
+    result = rollup.mean_table({}, start, end, index='City', columns=lambda dates: dates.dt.month_name(),
+                               monthly=monthly)
+    pd.testing.assert_frame_equal(result, expected, check_names=False)
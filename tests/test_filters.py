@@ -0,0 +1,135 @@
+"""Index-backed selections against the pandas expressions they replace."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from filters import BitmapIndex, CategorySelector, DateIndex, HierarchyIndex, QueryPlanner, RangeFilter
+from frames import records, sales
+
+
+@pytest.mark.parametrize('selection', [
+    {'site': None, 'gender': None},
+    {'site': ['ABCCP']},
+    {'site': ['ABCCP', 'KNH'], 'gender': ['F']},
+    {'gender': [np.nan]},
+    {'gender': ['F', np.nan], 'site': ['Lancet']},
+    {'site': []},
+    {'site': ['Nowhere']},
+])
+def test_bitmap_select_matches_isin(selection):
+    frame = records()
+    index = BitmapIndex(frame, ['site', 'gender'])
+    expected = frame
+    for col, values in selection.items():
+        if values is not None:
+            expected = expected[expected[col].isin(values)]
+    pd.testing.assert_frame_equal(index.select(frame, selection), expected)
+
+
+def test_bitmap_options_match_unique():
+    frame = records()
+    index = BitmapIndex(frame, ['site', 'gender'])
+    assert index.options('site') == list(frame['site'].unique())
+    assert [value for value in index.options('gender') if not pd.isna(value)] == \
+        [value for value in frame['gender'].unique() if not pd.isna(value)]
+
+
+@pytest.mark.parametrize('ranges', [
+    {'age': None},
+    {'age': (20, 40)},
+    {'age': (30, 30), 'days_gap': (0, 100)},
+    {'age': (97, 97), 'days_gap': (279, 279)},
+    {'age': (200, 300)},
+])
+def test_range_and_bitmap_match_query(ranges):
+    frame = records()
+    index = BitmapIndex(frame, ['site', 'gender'])
+    range_filter = RangeFilter(frame, ['age', 'days_gap'])
+    selection = {'site': ['ABCCP', 'Lancet'], 'gender': None}
+    expected = frame[frame['site'].isin(selection['site'])]
+    for col, bounds in ranges.items():
+        if bounds is not None:
+            expected = expected.query(f"{bounds[0]} <= {col} <= {bounds[1]}")
+    result = index.select(frame, selection, range_filter.positions(ranges))
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_range_bounds_skip_missing():
+    frame = records()
+    range_filter = RangeFilter(frame, ['age'])
+    assert range_filter.bounds('age') == (int(frame['age'].min()), int(frame['age'].max()))
+    assert RangeFilter(frame.iloc[:0], ['age']).bounds('age') == (0, 0)
+
+
+@pytest.mark.parametrize('selection', [
+    {'site': None},
+    {'site': ['KNH'], 'gender': ['M']},
+    {'gender': ['F', 'M'], 'site': ['ABCCP', 'Lancet']},
+    {'site': ['Nowhere'], 'gender': ['F']},
+])
+def test_query_planner_matches_query(selection):
+    frame = records()
+    planner = QueryPlanner(frame, ['site', 'gender'])
+    constrained = {col: values for col, values in selection.items() if values is not None}
+    expected = frame.query(' & '.join(f"{col} in @constrained['{col}']" for col in constrained)) if constrained \
+        else frame
+    rows, explanation = planner.select(frame, selection, explain=True)
+    pd.testing.assert_frame_equal(rows, expected)
+    assert len(explanation) == len(constrained)
+    if constrained:
+        assert explanation['rows_after'].iloc[-1] == len(expected)
+        assert explanation['estimated_rows'].is_monotonic_increasing
+
+
+@pytest.mark.parametrize('selection', [
+    {'Region': None, 'State': None, 'City': None},
+    {'Region': ['East']},
+    {'Region': ['East', 'West'], 'State': ['MA', 'TX']},
+    {'City': ['Nowhere']},
+])
+def test_hierarchy_matches_isin(selection):
+    frame = sales()
+    hierarchy = HierarchyIndex(frame, ['Region', 'State', 'City'])
+    mask = np.ones(len(frame), dtype=bool)
+    for level, values in selection.items():
+        if values is not None:
+            mask &= frame[level].isin(values).to_numpy()
+    pd.testing.assert_frame_equal(hierarchy.select(frame, selection), frame[mask])
+
+    within = np.arange(0, len(frame), 3)
+    expected = within[mask[within]]
+    positions = hierarchy.positions(selection, within)
+    np.testing.assert_array_equal(positions, expected)
+    above = {'Region': selection.get('Region')}
+    rows = frame.take(within)
+    if above['Region'] is not None:
+        rows = rows[rows['Region'].isin(above['Region'])]
+    assert hierarchy.options('State', above, within) == list(rows['State'].unique())
+
+
+def test_date_index_matches_between():
+    frame = sales()
+    index = DateIndex(frame, 'Order Date')
+    start, end = pd.Timestamp('2021-03-15'), pd.Timestamp('2022-02-01')
+    expected = index.frame[index.frame['Order Date'].between(start, end)]
+    pd.testing.assert_frame_equal(index.select(start, end), expected)
+    assert index.first == frame['Order Date'].min()
+    assert index.last == frame['Order Date'].max()
+    assert len(index.select(end, start)) == 0
+
+
+@pytest.mark.parametrize('selection', [
+    {'Region': ['East', 'West', 'Central'], 'City': None},
+    {'Region': ['East'], 'City': ['Boston', 'Austin']},
+    {'City': []},
+])
+def test_category_selector_matches_query(selection):
+    frame = sales()
+    selector = CategorySelector(frame, ['Region', 'City'])
+    lo, hi = 50, 400
+    window = frame.iloc[lo:hi]
+    expected = window
+    for col, values in selection.items():
+        if values is not None:
+            expected = expected[expected[col].isin(values)]
+    pd.testing.assert_frame_equal(selector.select(frame, selection, lo, hi), expected)
@@ -0,0 +1,60 @@
+"""describe() and describe_groups() against pandas describe() and mode()."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from stats import STAT_NAMES, describe, describe_groups, rounded
+
+
+def expected_stats(series, ddof=1):
+    values = series.dropna()
+    stats = values.describe().to_dict()
+    stats['std'] = values.std(ddof=ddof)
+    stats['range'] = stats['max'] - stats['min']
+    stats['mode'] = values.mode().min() if len(values) else np.nan
+    return stats
+
+
+def assert_stats_equal(result, expected):
+    assert list(result) == STAT_NAMES
+    for name in STAT_NAMES:
+        if pd.isna(expected[name]):
+            assert pd.isna(result[name]), name
+        else:
+            assert result[name] == pytest.approx(expected[name]), name
+
+
+@pytest.mark.parametrize('values', [
+    [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5],
+    [7.5],
+    [2, 2, 8, 8, np.nan, 0, 0],
+    [np.nan, np.nan],
+    [],
+])
+@pytest.mark.parametrize('ddof', [0, 1])
+def test_describe_matches_pandas(values, ddof):
+    series = pd.Series(values, dtype=float)
+    assert_stats_equal(describe(series, ddof=ddof), expected_stats(series, ddof))
+
+
+def test_describe_excludes_zero_and_reads_nullable_ints():
+    series = pd.Series([0, 12, 30, 0, 45, None, 30], dtype='Int64')
+    assert_stats_equal(describe(series, exclude_zero=True), expected_stats(series[series != 0].astype(float)))
+
+
+def test_describe_groups_matches_per_group_describe():
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({'program': rng.choice(['HPV', 'VIA', 'Colpo'], 300),
+                          'age': rng.integers(18, 70, 300).astype(float)})
+    frame.loc[::11, 'age'] = np.nan
+    frame.loc[::29, 'program'] = np.nan
+    result = describe_groups(frame, 'age', 'program')
+    assert list(result.index) == sorted(frame['program'].dropna().unique())
+    for program, ages in frame.groupby('program')['age']:
+        assert_stats_equal(result.loc[program].to_dict(), expected_stats(ages))
+
+
+def test_rounded():
+    formatted = rounded({'count': 3.0, 'mean': 1.23456, 'std': np.nan, 'mode': 4.0})
+    assert (formatted['count'], formatted['mean'], formatted['mode']) == (3, 1.23, 4)
+    assert isinstance(formatted['count'], int) and np.isnan(formatted['std'])